@@ -2,10 +2,482 @@
 # -*- coding: utf-8 -*-
 ####################
 
+import bisect
+import collections
+import functools
+import heapq
+import itertools
+import json
 import logging
+import math
+import mmap
+import os
+import struct
+import threading
 import indigo
 import time
 
+# Countdown refresh modes: "0" never displays a countdown, a number of seconds shows the remaining time rounded up
+# to that step, and "thresholds" only shows which of COUNTDOWN_THRESHOLDS the remaining time is under.
+COUNTDOWN_MODES = ("0", "1", "5", "10", "30", "60", "thresholds")
+COUNTDOWN_THRESHOLDS = (5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+COUNTDOWN_BUDGET = 0.25  # seconds of firing timers in one pass after which countdown writes are skipped
+TIMER_FIELDS = {"force": "forceTimer", "activity": "activityTimer", "coalesce": "coalesceTimer",  # kind -> Zone field
+                "score": "scoreTimer", "stats": "statsTimer"}  # holding its live deadline; "delay" keeps a tuple
+TIMER_COMPACT = 64  # timer heap entries below which stale ones are never swept out, see run_timers
+WARNING_INTERVAL = 300.0  # seconds between repeats of the same per-zone warning, see warn_limited
+SCORE_FLOOR = 1e-6  # a decaying sum this small counts as gone, see WeightedScore
+SCORE_MARGIN = 0.001  # seconds past the computed crossing that a weighted zone is re-evaluated, so it has crossed
+RATE_SPAN = 60.0  # seconds, the time constant of an activity zone's activationsPerMinute, see ActivityRate
+CALL_TIMEOUT = 30.0  # seconds an Indigo callback waits on the worker before giving up on it, see Plugin.call
+IMMEDIATE_DELAY = 0.1  # delays shorter than this take effect in the event path rather than through a timer
+SNAPSHOT_INTERVAL = 15.0  # at most one snapshot write this often, see save_snapshot
+SNAPSHOT_FILE = "snapshot.json"
+ZONE_STATES = {"area": ("delay_timer", "force_off_timer"), "scoreZone": ("score",),  # custom states in Devices.xml
+               "activityZone": ("activationsPerMinute", "activityLevel", "secondsSinceActivation")}
+HISTORY_RECORD = struct.Struct("<dIBB2x")  # time, zone id, occupied, kind - 16 bytes, see OccupancyHistory
+HISTORY_TRANSITION, HISTORY_CHECKPOINT = 0, 1
+HISTORY_LOOKBACK = 31  # days of segments searched back for a zone's state at the start of a range
+TRACE_HEADER = "# Occupatum sensor trace 1"  # first line of a trace file, see startTraceRecording
+BULK_ACTIONS = {"bulkCancelTimer": "area", "bulkForceZonesOff": "area",  # action -> the zone type it applies to
+                "bulkUpdateActivityZones": "activityZone", "bulkUpdateOccupancyZones": "area"}
+HISTOGRAMS = ("eventToTransition", "timerLateness", "tick", "queueWait")  # latencies kept by the plugin, see performance_stats
+
+
+def parse_seconds(value, default=0.0):
+    # Props arrive as strings from the config dialog, but as whatever a script passed from the update actions.
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_weights(value):
+    # A weighted zone's sensorWeights prop, "id:weight:half-life,...", as {id: (weight, half-life in seconds)}.  A
+    # half-life of 0 is a member that stops counting the moment it turns off.  Junk entries are skipped.
+    weights = {}
+    for entry in str(value or "").split(","):
+        parts = entry.strip().split(":")
+        try:
+            memberID = int(parts[0])
+        except ValueError:
+            continue
+        weight = parse_seconds(parts[1], 1.0) if len(parts) > 1 else 1.0
+        halfLife = parse_seconds(parts[2]) if len(parts) > 2 else 0.0
+        weights[memberID] = (weight, halfLife)
+    return weights
+
+
+def format_weights(weights):
+    return ",".join(f"{memberID}:{weight:g}:{halfLife:g}" for memberID, (weight, halfLife) in weights.items())
+
+
+def nest_counters(counter):
+    # {"timersArmed.delay": 2, "timersArmed.force": 1} -> {"timersArmed": {"delay": 2, "force": 1}}, so the stats
+    # can go into an indigo.Dict, whose keys can't contain a dot.
+    nested = {}
+    for name, value in sorted(counter.items()):
+        group, _, key = name.partition(".")
+        if key:
+            nested.setdefault(group, {})[key] = value
+        else:
+            nested[name] = value
+    return nested
+
+
+def to_indigo(value):
+    # A reply_dict can only hold indigo.Dict and indigo.List, not their Python equivalents.
+    if isinstance(value, dict):
+        converted = indigo.Dict()
+        for key, item in value.items():
+            converted[key] = to_indigo(item)
+        return converted
+    if isinstance(value, (list, tuple)):
+        converted = indigo.List()
+        for item in value:
+            converted.append(to_indigo(item))
+        return converted
+    return value
+
+
+################################################################################
+class Histogram:
+    # Latencies in power-of-two millisecond buckets: bucket n holds the samples under 2**n ms, bucket 0 those under
+    # a millisecond.  A sample is one add to a list slot, and a percentile is only good to within its bucket -
+    # plenty for telling a 5ms path from a 500ms one.
+    __slots__ = ("buckets", "count", "total", "max")
+    BUCKETS = 24  # the last one takes everything from 2**22 ms, a bit over an hour, up
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = max(0.0, seconds * 1000.0)
+        self.buckets[min(self.BUCKETS - 1, int(ms).bit_length())] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction):
+        # upper bound, in ms, of the bucket holding the sample at this fraction of the way up
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return round(min(float(2 ** bucket), self.max), 3)
+        return round(self.max, 3)
+
+    def summary(self):
+        return {"count": self.count, "meanMs": round(self.total / self.count, 3) if self.count else 0.0,
+                "p50Ms": self.percentile(0.5), "p90Ms": self.percentile(0.9), "p99Ms": self.percentile(0.99),
+                "maxMs": round(self.max, 3)}
+
+
+def on_worker(method):
+    # For the Indigo callbacks and actions that touch zone state: the method runs on the worker thread, which owns
+    # that state, and the caller gets back whatever it returns.  See Plugin.call.
+    @functools.wraps(method)
+    def serialized(self, *args, **kwargs):
+        return self.call(method, self, *args, **kwargs)
+    return serialized
+
+
+################################################################################
+class OccupancyHistory:
+    # Every zone transition, appended as a fixed-width HISTORY_RECORD to one file per local day.  A segment
+    # opens with a checkpoint of every zone's state, so finding a zone's state at any moment never has to look
+    # further back than the previous segment.  Reads go through mmap and binary search on the timestamps, which
+    # are in order, so a range query touches only the records in its range and memory doesn't grow with history.
+    def __init__(self, folder):
+        self.folder = folder
+        self.day = None             # the day of the segment open for appending
+        self.file = None
+
+    @staticmethod
+    def day_of(timestamp):
+        return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+    @staticmethod
+    def day_start(day):
+        return time.mktime(time.strptime(day, "%Y-%m-%d"))
+
+    def next_day(self, day):
+        return self.day_of(self.day_start(day) + 129600.0)  # 36 hours on, so a 23 or 25 hour day can't trip it
+
+    def previous_day(self, day):
+        return self.day_of(self.day_start(day) - 43200.0)
+
+    def path(self, day):
+        return os.path.join(self.folder, day + ".bin")
+
+    def needs_segment(self, timestamp):
+        return self.day != self.day_of(timestamp)
+
+    def append(self, timestamp, zoneID, occupied, kind=HISTORY_TRANSITION):
+        day = self.day_of(timestamp)
+        if day != self.day:
+            self.close()
+            self.file = open(self.path(day), "ab", buffering=0)  # one write per record, nothing held back
+            self.day = day
+        self.file.write(HISTORY_RECORD.pack(timestamp, zoneID, bool(occupied), kind))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = self.day = None
+
+    def scan(self, day, start=None, reverse=False):
+        # The records of one segment, from the first at or after start (or, reversed, the last before it).
+        try:
+            f = open(self.path(day), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            count = os.fstat(f.fileno()).st_size // HISTORY_RECORD.size  # a torn last record is ignored
+            if not count:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as records:
+                first = 0
+                if start is not None:
+                    lo, hi = 0, count
+                    while lo < hi:
+                        mid = (lo + hi) // 2
+                        if HISTORY_RECORD.unpack_from(records, mid * HISTORY_RECORD.size)[0] < start:
+                            lo = mid + 1
+                        else:
+                            hi = mid
+                    first = lo
+                indexes = range(first - 1, -1, -1) if reverse else range(first, count)
+                for index in indexes:
+                    yield HISTORY_RECORD.unpack_from(records, index * HISTORY_RECORD.size)
+
+    def state_at(self, zoneID, timestamp):
+        # The zone's state just before timestamp, or None if the history doesn't go back that far.
+        day = self.day_of(timestamp)
+        for _ in range(HISTORY_LOOKBACK):
+            for when, recordZone, occupied, kind in self.scan(day, timestamp, reverse=True):
+                if recordZone == zoneID:
+                    return bool(occupied)
+            day = self.previous_day(day)
+        return None
+
+    def summarize(self, zoneIDs, start, end):
+        # Occupancy of each zone over [start, end): occupied seconds, transitions into each state, and the
+        # longest unbroken stretch of each.  A zone with no history before start counts as unoccupied until
+        # its first record.
+        zones = {}
+        for zoneID in zoneIDs:
+            zones[zoneID] = {"occupied": bool(self.state_at(zoneID, start)), "since": start,
+                             "occupiedSeconds": 0.0, "occupiedTransitions": 0, "vacantTransitions": 0,
+                             "longestOccupied": 0.0, "longestVacant": 0.0}
+
+        def close(zone, until):
+            length = until - zone["since"]
+            if zone["occupied"]:
+                zone["occupiedSeconds"] += length
+                zone["longestOccupied"] = max(zone["longestOccupied"], length)
+            else:
+                zone["longestVacant"] = max(zone["longestVacant"], length)
+
+        day = self.day_of(start)
+        while self.day_start(day) < end:
+            for when, zoneID, occupied, kind in self.scan(day, start):
+                if when >= end:
+                    break
+                zone = zones.get(zoneID, None)
+                if zone is None or bool(occupied) == zone["occupied"]:  # not asked for, or a checkpoint agreeing
+                    continue
+                close(zone, when)
+                zone["occupied"], zone["since"] = bool(occupied), when
+                if kind == HISTORY_TRANSITION:
+                    zone["occupiedTransitions" if occupied else "vacantTransitions"] += 1
+            day = self.next_day(day)
+
+        for zone in zones.values():
+            close(zone, end)
+            del zone["occupied"], zone["since"]
+            for key in ("occupiedSeconds", "longestOccupied", "longestVacant"):
+                zone[key] = round(zone[key], 3)
+        return zones
+
+
+################################################################################
+class WeightedScore:
+    # The score of a weighted zone, kept up to date one member change at a time.  A member adds its full weight
+    # while it is on.  One with a half-life goes on counting after it turns off, its contribution halving every
+    # half-life.  Members sharing a half-life decay at the same rate, so their contributions are kept as one sum
+    # per half-life, stamped with when it was last touched and decayed only when read: the score costs one term
+    # per distinct half-life, however many members there are, and nothing has to be polled.
+    __slots__ = ("weights", "steady", "decaying", "released")
+
+    def __init__(self, weights):
+        self.weights = weights      # member id -> (weight, half-life), see parse_weights; missing members weigh 1
+        self.steady = 0.0           # the weights of the members that are on
+        self.decaying = {}          # half-life -> [sum of the contributions decaying at that rate, as of when]
+        self.released = {}          # member id -> when it turned off, while its contribution may still be decaying
+
+    def set_member(self, memberID, onState, now):
+        weight, halfLife = self.weights.get(memberID, (1.0, 0.0))
+        if onState:
+            self.steady += weight
+            released = self.released.pop(memberID, None)
+            if released is not None:  # what was left of its last release gives way to the full weight
+                self.add(halfLife, -weight * 0.5 ** ((now - released) / halfLife), now)
+        else:
+            self.steady -= weight
+            if halfLife > 0.0:
+                self.add(halfLife, weight, now)
+                self.released[memberID] = now
+
+    def add(self, halfLife, amount, now):
+        value = self.decayed(halfLife, now) + amount
+        if value > SCORE_FLOOR:
+            self.decaying[halfLife] = [value, now]
+        else:
+            self.decaying.pop(halfLife, None)
+
+    def decayed(self, halfLife, now):
+        if halfLife not in self.decaying:
+            return 0.0
+        value, when = self.decaying[halfLife]
+        return value * 0.5 ** ((now - when) / halfLife)
+
+    def value(self, now):
+        return self.steady + sum(self.decayed(halfLife, now) for halfLife in self.decaying)
+
+    def falls_below(self, level, now):
+        # When the score drops below level if no member changes before then, or None if decay alone never gets it
+        # there.  The score only falls between changes, so one decaying sum has a closed form and several are a
+        # bisection between now and the time each would have decayed its share away.
+        headroom = level - self.steady
+        if headroom <= 0.0 or not self.decaying:
+            return None
+        if len(self.decaying) == 1:
+            ((halfLife, (value, when)),) = self.decaying.items()
+            return max(now, when + halfLife * math.log2(value / headroom)) if value >= headroom else now
+        share = headroom / len(self.decaying)
+        low = now
+        high = max(when + halfLife * math.log2(max(value, share) / share) for halfLife, (value, when) in self.decaying.items())
+        while high - low > SCORE_MARGIN:
+            middle = (low + high) / 2.0
+            if self.value(middle) < level:
+                high = middle
+            else:
+                low = middle
+        return high
+
+
+################################################################################
+class ActivityRate:
+    # An activity zone's rolling figures, each O(1) however many activations arrive: activations per minute, an
+    # activity level and when the latest one was.  The first two are activation counts decaying exponentially -
+    # over RATE_SPAN, which makes the count a per-minute rate, and over the zone's window, scaled so 1.0 is what
+    # occupies it.  Both are kept as of the last activation and decayed when read.
+    __slots__ = ("perMinute", "level", "when", "last")
+
+    def __init__(self):
+        self.perMinute = 0.0
+        self.level = 0.0
+        self.when = 0.0
+        self.last = None            # time of the latest activation, None before the first
+
+    def activation(self, now, span):
+        elapsed = now - self.when
+        self.perMinute = self.perMinute * math.exp(-elapsed / RATE_SPAN) + 1.0
+        self.level = self.level * math.exp(-elapsed / span) + 1.0
+        self.when = self.last = now
+
+    def figures(self, now, span, scale):
+        elapsed = now - self.when
+        return {"activationsPerMinute": round(self.perMinute * math.exp(-elapsed / RATE_SPAN), 2),
+                "activityLevel": round(self.level * math.exp(-elapsed / span) / scale, 2),
+                "secondsSinceActivation": int(now - self.last)}
+
+
+################################################################################
+class DeviceShadow:
+    # What the event and timer paths need to know about a device, kept current from Indigo's callbacks so they
+    # don't have to ask the server for it.  See Plugin.shadows.
+    __slots__ = ("id", "name", "onState")
+
+    def __init__(self, device):
+        self.id = device.id
+        self.refresh(device)
+
+    def refresh(self, device):
+        self.name = device.name
+        self.onState = bool(device.onState)
+
+
+class LazyDevice:
+    # A zone device as the event and timer paths pass it around.  id, name and onState come from its shadow; the
+    # first use of anything else - in practice a state write - fetches the device from the server, once.
+    __slots__ = ("shadow", "device")
+
+    def __init__(self, shadow):
+        self.shadow = shadow
+        self.device = None
+
+    @property
+    def id(self):
+        return self.shadow.id
+
+    @property
+    def name(self):
+        return self.shadow.name
+
+    @property
+    def onState(self):
+        return self.shadow.onState
+
+    def __getattr__(self, name):
+        if self.device is None:
+            self.device = indigo.devices[self.shadow.id]
+        return getattr(self.device, name)
+
+
+################################################################################
+class Zone:
+    # The runtime record for one running zone: its parsed config, its members, its timers and its activity
+    # history.  deviceStartComm builds it from the props and deviceStopComm throws it away, so nothing on the
+    # event or timer paths re-reads or re-parses pluginProps.  A props edit that keeps the members reconfigures
+    # it in place instead, see Plugin.apply_props.
+    __slots__ = ("id", "name", "typeId", "props", "sensors", "members", "onCount",
+                 "onSensorsOnOff", "onAnyAll", "onDelay", "offDelay", "forceOff", "forceOffRearm", "countdownMode",
+                 "activityWindow", "activityCount", "activity", "rate", "statsEvery", "coalesce", "weights", "onScore",
+                 "offScore", "score", "delayTimer", "forceTimer", "activityTimer", "coalesceTimer", "scoreTimer",
+                 "statsTimer", "burstEvents", "shown",
+                 "eventTime", "stats", "debug", "warned")
+
+    def __init__(self, device, sensors, stats):
+        props = device.pluginProps
+        self.id = device.id
+        self.name = device.name
+        self.typeId = device.deviceTypeId
+        self.sensors = sensors      # member ids in props order, which is what the props get rewritten from
+        self.members = {}           # live member id -> onState as this zone last counted it
+        self.onCount = 0            # how many of those members are on
+        self.activity = ()
+        self.rate = ActivityRate() if self.typeId == 'activityZone' else None
+        self.score = None           # the WeightedScore of a weighted zone, built with its members, see resync_members
+        self.configure(props)
+
+        self.delayTimer = None      # (deadline, occupied)
+        self.forceTimer = None      # deadline
+        self.activityTimer = None   # deadline at which the oldest time hack expires
+        self.coalesceTimer = None   # deadline at which the sensor events folded so far get evaluated
+        self.scoreTimer = None      # deadline at which a weighted zone's decaying score crosses its off level
+        self.statsTimer = None      # deadline at which an activity zone next publishes its rate figures
+        self.burstEvents = 0        # sensor events folded into the pending evaluation
+        self.shown = {}             # countdown state key -> value last written, so unchanged values aren't re-sent
+        self.eventTime = None       # when the latest sensor event arrived, for the eventToTransition latency
+        self.stats = stats          # this zone's performance counters, see Plugin.count
+        self.warned = {}            # warning key -> [time last logged, repeats suppressed since], see warn_limited
+
+    def configure(self, props):
+        # Parse everything in the props but the members.  The activity history is kept, trimmed to the new count.
+        self.props = dict(props)    # what this was configured from, see deviceStartComm
+        self.onSensorsOnOff = props.get("onSensorsOnOff", "on")
+        self.onAnyAll = props.get("onAnyAll", "all")
+        self.onDelay = parse_seconds(props.get("onDelayValue", "0"))
+        self.offDelay = parse_seconds(props.get("offDelayValue", "0"))
+        self.forceOff = parse_seconds(props.get("forceOffValue", ""))  # 0 for none
+        self.forceOffRearm = str(props.get("forceOffRearm", True)).lower() == "true"  # a script may leave "false"
+        mode = str(props.get("countdownRefresh", "default"))
+        self.countdownMode = mode if mode in COUNTDOWN_MODES else None  # None for the plugin default
+
+        self.activityWindow = parse_seconds(props.get("activityWindow", "0"))
+        self.activityCount = int(parse_seconds(props.get("activityCount", "0")))
+        self.activity = self.activity_history(self.activity)
+        self.statsEvery = parse_seconds(props.get("statsRefresh", "60"))  # 0 never publishes the rate figures
+        self.coalesce = parse_seconds(props.get("coalesceWindow", "0")) / 1000.0  # 0 to evaluate every event
+
+        # a weighted zone goes on when its score reaches onScore and off once it drops below offScore
+        self.weights = parse_weights(props.get("sensorWeights", ""))
+        self.onScore = parse_seconds(props.get("onScore", "1"), 1.0)
+        self.offScore = min(self.onScore, parse_seconds(props.get("offScore", ""), self.onScore))
+        self.debug = str(props.get("debugZone", False)).lower() == "true"
+
+    def activity_history(self, timestamps=()):
+        # Time hacks of sensor activations, oldest first.  Occupancy only asks whether activityCount of them fall
+        # inside the window, so only the newest activityCount are ever worth keeping - a chatty sensor can't grow
+        # this past that.
+        return collections.deque(timestamps, maxlen=max(1, self.activityCount))
+
+    def expire_activity(self, now):
+        # Drop every time hack older than the window in one go, returning how many went.
+        expired = bisect.bisect_left(self.activity, now - self.activityWindow)
+        for _ in range(expired):
+            self.activity.popleft()
+        return expired
+
+
 ################################################################################
 class Plugin(indigo.PluginBase):
 
@@ -15,26 +487,142 @@ class Plugin(indigo.PluginBase):
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
 
-        pfmt = logging.Formatter('%(asctime)s.%(msecs)03d\t[%(levelname)8s] %(name)20s.%(funcName)-25s%(msg)s', datefmt='%Y-%m-%d %H:%M:%S')
+        pfmt = logging.Formatter('%(asctime)s.%(msecs)03d\t[%(levelname)8s] %(name)20s.%(funcName)-25s%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
         self.plugin_file_handler.setFormatter(pfmt)
         self.logLevel = int(self.pluginPrefs.get("logLevel", logging.INFO))
         self.indigo_log_handler.setLevel(self.logLevel)
         self.logger.debug(f"logLevel = {self.logLevel}")
-
-        self.zoneList = {}
-        self.activityZoneList = {}
-        self.watchList = {}
-        self.delayTimers = {}
-        self.forceTimers = {}
-        self.triggers = {}
+        self.debugAll = self.debug_logged()  # see trace
+        self.clock = time.time      # everything that schedules or stamps goes through this, so a replay can swap it
+
+        self.zones = {}             # zone id -> Zone, for every running zone
+        self.shadows = {}           # device id -> DeviceShadow, for every running zone and every sensor one watches
+        self.parkedActivity = {}    # zone id -> activity history of a zone stopped for a restart, see deviceStartComm
+        self.watchList = {}         # sensor id -> {ids of the zones watching it}
+        self.zoneWatches = {}       # zone id -> {ids of the sensors it is registered against}, the reverse of watchList
+        self.triggers = {}          # trigger id -> its key in triggerIndex
+        self.triggerIndex = {}      # (zone id, occupied) -> {trigger id: trigger}, the triggers a transition fires
+        self.candidates = None      # sensor id -> name for every device a zone can use, built by the first dialog
+        self.candidateList = None   # the same, as the sorted (id, name) list the dialogs show; None when stale
+        self.zoneRanks = {}         # zone id -> its depth in the nested-zone graph, filled in on demand, see zone_rank
+        self.propagation = threading.local()  # per thread, the propagation pass running on it, see propagate_transition
+
+        self.countdownRefresh = self.valid_countdown_mode(self.pluginPrefs.get("countdownRefresh", "1"), "1")
+
+        # performance counters, plugin-wide and per zone, see count.  A zone's survive its restarts.
+        self.counters = collections.Counter()
+        self.zoneStats = {}         # zone id -> Counter
+        self.histograms = {name: Histogram() for name in HISTOGRAMS}
+        self.statsSince = time.time()
+
+        # pending deadlines as (deadline, seq, kind, zoneID).  Cancelling a timer only clears it on the Zone; the
+        # heap entry is left behind, dropped once it reaches the top and swept out when too many pile up, see
+        # run_timers and timer_live.
+        self.timerHeap = []
+        self.timerSeq = itertools.count()
+        self.timerCompactAt = TIMER_COMPACT  # heap size at which the next sweep is due
+        self.counting = set()       # ids of zones with a delay or force-off timer running, i.e. a countdown to show
+        self.wakeup = threading.Event()
+
+        # Zone state has one writer, the worker: runConcurrentThread.  Indigo's callbacks hand it their changes
+        # through this queue, see call and submit, and only run inline while there is no worker to hand them to.
+        self.events = collections.deque()  # (function, args, reply slot or None, when queued)
+        self.worker = None          # thread id of the worker while it runs
+        self.queueLock = threading.RLock()  # only for handing over to and from the worker, see enqueue
+
+        self.traceFile = None       # open sensor trace while recording, see startTraceRecording
+        self.traceStart = 0.0
+        self.coldStart = None       # timings for the startup report while the zones start, see cold_start_done
+
+        # timers and activity survive a plugin restart in a snapshot file, see save_snapshot
+        self.snapshotEntries = {}   # zone id -> that zone's part of the snapshot, already encoded
+        self.snapshotDirty = set()  # ids of the zones whose entry needs encoding again
+        self.snapshotDue = None     # when the next write is scheduled for, None if none is
+        self.restored = {}          # zone id -> snapshot entry read at startup, until the zone starts
+        self.history = None         # the OccupancyHistory, opened on first use
 
     def startup(self):
         self.logger.info("Starting Occupatum")
-        self.reconcile_zones()
+        started = time.perf_counter()
+        self.load_snapshot()
+        pruned = self.reconcile_zones()
         indigo.devices.subscribeToChanges()
+        self.coldStart = {"started": started, "reconcile": time.perf_counter() - started, "pruned": pruned,
+                          "pending": {device.id for device in indigo.devices.iter("self") if device.enabled},
+                          "zones": 0, "start": 0.0, "resync": 0.0, "evaluate": 0.0, "writes": self.counters["writes"],
+                          "skipped": 0}
+        if not self.coldStart["pending"]:
+            self.cold_start_done()
+
+    def cold_start_done(self):
+        # Every zone enabled at startup has started: log where the time went, once.
+        report, self.coldStart = self.coldStart, None
+        total = time.perf_counter() - report["started"]
+        self.logger.info(f"Started {report['zones']} zone(s) in {total * 1000.0:.0f}ms: reconcile {report['reconcile'] * 1000.0:.0f}ms "
+                         f"({report['pruned']} pruned), zone starts {report['start'] * 1000.0:.0f}ms, of which member resync "
+                         f"{report['resync'] * 1000.0:.0f}ms and first evaluation {report['evaluate'] * 1000.0:.0f}ms; "
+                         f"{self.counters['writes'] - report['writes']} state write(s), {report['skipped']} unchanged write(s) skipped")
 
     def shutdown(self):
         self.logger.info("Stopping Occupatum")
+        self.stopTraceRecording()
+        self.save_snapshot()
+        if self.history is not None:
+            self.history.close()
+
+    def data_folder(self, *parts):
+        # The plugin's own folder under Indigo's Preferences, or a folder inside it, created on first use.
+        folder = os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins", self.pluginId, *parts)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    ########################################
+    # Logging for the event and timer paths
+    ########################################
+
+    def debug_logged(self):
+        # Whether a debug record would reach either place the plugin logs to: the Indigo event log, at logLevel,
+        # or the plugin's own log file, whose handler has a level of its own and by default takes everything.
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        return min(self.logLevel, self.plugin_file_handler.level) <= logging.DEBUG
+
+    def trace(self, zone, msg, *args):
+        # Debug logging for the hot paths.  Unless debugging is on for the whole plugin or for this zone it costs
+        # one attribute test: no record, no formatting.  msg is %-style so the arguments are only formatted if a
+        # handler actually emits it.  A zone's own debug switch logs at INFO, so it shows without the plugin's.
+        if self.debugAll:
+            self.logger.debug(msg, *args)
+        elif zone is not None and zone.debug:
+            self.logger.info("[debug] " + msg, *args)
+
+    def warn_limited(self, zone, key, msg, *args):
+        # A warning that can fire on every event, limited to one per WARNING_INTERVAL per zone.  The next one to
+        # get through says how many were swallowed in between.
+        if zone is None:
+            self.logger.warning(msg, *args)
+            return
+        now = self.clock()
+        last = zone.warned.get(key, None)
+        if last is not None and now - last[0] < WARNING_INTERVAL:
+            last[1] += 1
+            return
+        zone.warned[key] = [now, 0]
+        if last is not None and last[1]:
+            msg += " (%d similar message(s) suppressed)"
+            args += (last[1],)
+        self.logger.warning(msg, *args)
+
+    def count(self, zone, name, n=1):
+        # Bump a performance counter plugin-wide and, given a zone, for the zone.  Names with a dot are grouped
+        # by what comes before it, see nest_counters.
+        self.counters[name] += n
+        if zone is not None:
+            zone.stats[name] += n
+
+    def stopConcurrentThread(self):
+        indigo.PluginBase.stopConcurrentThread(self)
+        self.wakeup.set()  # the timer thread may be waiting with no deadline at all
 
     ################################################################################
     #
@@ -51,26 +639,35 @@ class Plugin(indigo.PluginBase):
             if not sensorID:
                 continue
             try:
-                sensorIDs.append(int(sensorID))
+                sensorID = int(sensorID)
             except ValueError:
                 self.logger.warning(f"{device.name}: ignoring invalid sensor device ID '{sensorID}'")
+                continue
+            if sensorID not in sensorIDs:  # a duplicate would be counted twice by the zone's on counter
+                sensorIDs.append(sensorID)
         return sensorIDs
 
     def save_sensors_for_zone(self, zoneDevice, sensorIDs):
         # Rewrite the sensorDevices prop.  Only the owning plugin can do this - the config dialog filters out an
         # unresolvable ID, so there's nothing for the user to select and delete, and Indigo blocks scripts from
-        # touching pluginProps.  Replacing the props restarts the device, which rebuilds zoneList/watchList.
+        # touching pluginProps.  Replacing the props restarts the device, which rebuilds its Zone and watches.
+        zoneDevice.replacePluginPropsOnServer(self.sensors_props(zoneDevice, sensorIDs))
+
+    def sensors_props(self, zoneDevice, sensorIDs):
+        # The zone's props with sensorDevices set to these, for save_sensors_for_zone or persist_props to write.
         if not sensorIDs:
             self.logger.warning(f"{zoneDevice.name}: zone no longer has any sensor devices, edit the zone to add one")
         props = zoneDevice.pluginProps
         props["sensorDevices"] = ",".join(str(x) for x in sensorIDs)
-        zoneDevice.replacePluginPropsOnServer(props)
+        return props
 
     def reconcile_zones(self):
         # One-time cleanup at plugin start, before any device starts.  A sensor deleted while the plugin was
         # stopped never went through deviceDeleted, so its ID is still sitting in the props with no way for the
         # user to remove it.  This is the only place that prunes: doing it from deviceStartComm would restart a
         # device in the middle of starting it, and doing it from a getter makes every read a destructive write.
+        # Only zones that actually change are written.  Returns how many that was.
+        pruned = 0
         for device in indigo.devices.iter("self"):
             raw = device.pluginProps.get("sensorDevices", "")
             liveIDs = [x for x in self.sensor_ids_for_zone(device) if x in indigo.devices]
@@ -80,326 +677,1193 @@ class Plugin(indigo.PluginBase):
             # covers deleted IDs, unparseable junk and stray whitespace in one comparison
             self.logger.warning(f"{device.name}: pruning zone sensor list, '{raw}' -> '{canonical}'")
             self.save_sensors_for_zone(device, liveIDs)
-
-    def live_sensors(self, zoneDevice):
-        # The zone's members that still exist right now.  Pure reader - reconcile_zones owns pruning the props.
-        return [x for x in self.zoneList.get(zoneDevice.id, []) if x in indigo.devices]
-
-    def add_zone_to_watch_list(self, device, sensorsInZone):
-        # Register the zone against each of its sensors.  Appending only if absent keeps a second deviceStartComm
-        # without a matching deviceStopComm from double-registering the zone, which would run check_sensors twice
-        # per sensor change.
-        for sensor in sensorsInZone:
-            if sensor not in self.watchList:
-                self.watchList[sensor] = list()
-            if device.id not in self.watchList[sensor]:
-                self.watchList[sensor].append(device.id)
-        self.logger.debug(f"{device.name}: watchList updated: {self.watchList}")
-
-    def remove_zone_from_watch_list(self, device, sensorsInZone):
-        # Mirror of add_zone_to_watch_list.  Unregistering has to work from the same list the registration used - the
-        # zoneList entry - not from a re-read of the props, which may already have changed underneath us.
-        for sensor in sensorsInZone:
-            if sensor in self.watchList and device.id in self.watchList[sensor]:
-                self.watchList[sensor].remove(device.id)
-            if sensor in self.watchList and not self.watchList[sensor]:
-                del self.watchList[sensor]  # don't leak an empty list per sensor ever seen
-        self.logger.debug(f"{device.name}: watchList updated: {self.watchList}")
+            pruned += 1
+        return pruned
+
+    def resync_members(self, zone):
+        # Rebuild the zone's view of its live members and how many are on.  This is the only full scan; between
+        # restarts the count is kept up to date from deviceUpdated, one member at a time.  Pure reader of the
+        # props - reconcile_zones owns pruning them.
+        zone.members = {}
+        for sensorID in zone.sensors:
+            shadow = self.shadow(sensorID)
+            if shadow is not None:
+                zone.members[sensorID] = shadow.onState
+        zone.onCount = sum(zone.members.values())
+        if zone.typeId == 'scoreZone':  # members that were already off no longer count, however recently
+            now = self.clock()
+            zone.score = WeightedScore(zone.weights)
+            for sensorID, onState in zone.members.items():
+                if onState:
+                    zone.score.set_member(sensorID, True, now)
+
+    def shadow(self, deviceID):
+        # The device's shadow, made from the server's copy the first time a zone watches it.  None if there is no
+        # such device.  deviceUpdated keeps it current from then on, deviceDeleted and unwatch_sensor drop it.
+        shadow = self.shadows.get(deviceID, None)
+        if shadow is None and deviceID in indigo.devices:
+            shadow = self.shadows[deviceID] = DeviceShadow(indigo.devices[deviceID])
+        return shadow
+
+    def zone_device(self, zoneID):
+        # The zone's device for the event and timer paths, see LazyDevice.  None if the device is gone.
+        shadow = self.shadows.get(zoneID, None)
+        return None if shadow is None else LazyDevice(shadow)
+
+    def update_member_state(self, zone, sensorID, onState):
+        # Apply one member's change to the zone's count.  Each zone keeps its own view of its members, so a
+        # change it already saw in resync_members isn't counted twice when its deviceUpdated arrives.
+        if sensorID not in zone.members or zone.members[sensorID] == onState:
+            return False
+        zone.members[sensorID] = onState
+        zone.onCount += 1 if onState else -1
+        if zone.score is not None:
+            zone.score.set_member(sensorID, onState, self.clock())
+        return True
+
+    def watch_sensors(self, device, sensorsInZone):
+        # Register the zone against exactly these sensors, touching only the ones that changed.  Registering
+        # against a set makes a second deviceStartComm without a matching deviceStopComm harmless, rather than
+        # running check_sensors twice per sensor change.
+        started = device.id not in self.zoneWatches
+        watched = self.zoneWatches.setdefault(device.id, set())
+        wanted = set(sensorsInZone)
+        added, removed = wanted - watched, watched - wanted
+        for sensor in added:
+            self.watchList.setdefault(sensor, set()).add(device.id)
+        for sensor in removed:
+            self.unwatch_sensor(sensor, device.id)
+        watched.clear()
+        watched.update(wanted)
+        if any(sensor in self.zoneWatches or sensor in self.zoneRanks for sensor in added | removed) or \
+                (started and device.id in self.watchList):  # the nesting changed, see rerank
+            self.rerank(device.id)
+        elif started:
+            self.zoneRanks.pop(device.id, None)
+        if added or removed:
+            self.trace(self.zones.get(device.id, None), "%s: watching sensors +%s -%s", device.name, sorted(added), sorted(removed))
+
+    def unwatch_zone(self, zoneID):
+        # Drop every registration the zone made.  Works from what was actually registered, not from the props or
+        # the Zone, either of which may already have changed underneath us.
+        removed = self.zoneWatches.pop(zoneID, None)
+        if removed is None:
+            return
+        for sensor in removed:
+            self.unwatch_sensor(sensor, zoneID)
+        self.rerank(zoneID)
+        if removed:
+            self.trace(self.zones.get(zoneID, None), "zone %s: watching sensors -%s", zoneID, sorted(removed))
+
+    def unwatch_sensor(self, sensor, zoneID):
+        zones = self.watchList.get(sensor, None)
+        if zones is not None:
+            zones.discard(zoneID)
+            if not zones:
+                del self.watchList[sensor]  # don't leak an empty set per sensor ever seen
+                if sensor not in self.zones:
+                    self.shadows.pop(sensor, None)
 
     def remove_sensor_from_zone(self, zoneID, sensorID):
-        # Drop a deleted sensor from a zone.  zoneList mirrors the props exactly, so it is the source of truth
-        # here - re-reading the props would clobber a concurrent deletion whose write hasn't landed yet.
-        if zoneID not in self.zoneList or sensorID not in self.zoneList[zoneID]:
+        # Drop a deleted sensor from a running zone and return (zone device, props) for persist_props to write,
+        # or None if there is nothing to write.  The Zone's sensors mirror the props exactly, so they are the
+        # source of truth here - re-reading the props would clobber a concurrent deletion whose write hasn't
+        # landed yet.
+        zone = self.zones.get(zoneID, None)
+        if zone is None or sensorID not in zone.sensors:
             self.logger.debug(f"zone {zoneID}: sensor device {sensorID} is not a member, nothing to remove")
-            return
+            return None
 
-        self.zoneList[zoneID].remove(sensorID)
-        remaining = list(self.zoneList[zoneID])
+        zone.sensors.remove(sensorID)
+        if zone.members.pop(sensorID, False):
+            zone.onCount -= 1
+            if zone.score is not None:  # fades out like any other member turning off
+                zone.score.set_member(sensorID, False, self.clock())
+        remaining = list(zone.sensors)
 
         if zoneID not in indigo.devices:
-            return
+            return None
 
         zoneDevice = indigo.devices[zoneID]
         self.logger.warning(f"{zoneDevice.name}: removed deleted sensor device {sensorID} from zone, {len(remaining)} sensor(s) left")
-        self.save_sensors_for_zone(zoneDevice, remaining)
+        return zoneDevice, self.sensors_props(zoneDevice, remaining)
 
     def forget_zone(self, zoneID):
         # A zone device itself was deleted.  deviceStopComm normally does this, but it isn't guaranteed to run
         # for a device that's going away, and nothing else clears these.
-        self.zoneList.pop(zoneID, None)
-        self.activityZoneList.pop(zoneID, None)
-        self.delayTimers.pop(zoneID, None)
-        self.forceTimers.pop(zoneID, None)
-        for sensor in list(self.watchList):
-            if zoneID in self.watchList[sensor]:
-                self.watchList[sensor].remove(zoneID)
-            if not self.watchList[sensor]:
-                del self.watchList[sensor]
+        zone = self.zones.pop(zoneID, None)
+        if zone is not None:
+            self.cancel_timers(zone)
+        self.parkedActivity.pop(zoneID, None)
+        self.zoneStats.pop(zoneID, None)
+        if self.snapshotEntries.pop(zoneID, None) is not None:
+            self.schedule_snapshot()
+        self.unwatch_zone(zoneID)
+
+    def deviceCreated(self, newDevice):
+        indigo.PluginBase.deviceCreated(self, newDevice)
+        self.index_candidate(newDevice)
 
     def deviceDeleted(self, delDevice):
         indigo.PluginBase.deviceDeleted(self, delDevice)
-
-        if delDevice.id in self.zoneList:  # one of our own zone devices was deleted
+        if self.candidates is not None and self.candidates.pop(delDevice.id, None) is not None:
+            self.candidateList = None
+        self.persist_props(self.device_deleted, delDevice)  # it may rewrite zones' props
+
+    def device_deleted(self, delDevice):
+        # The worker's half of deviceDeleted, returning (None, [(zone device, props)]) for persist_props.
+        writes = []
+        self.shadows.pop(delDevice.id, None)
+        if delDevice.id in self.zoneWatches or delDevice.id in self.parkedActivity:  # one of our own zone devices was deleted
             self.logger.debug(f"Zone Device deleted: {delDevice.name}")
             self.forget_zone(delDevice.id)
 
         if delDevice.id in self.watchList:  # a sensor used by one or more zones was deleted
             self.logger.debug(f"Watched Device deleted: {delDevice.name}")
             for zoneID in self.watchList.pop(delDevice.id):
-                self.remove_sensor_from_zone(zoneID, delDevice.id)
+                self.zoneWatches.get(zoneID, set()).discard(delDevice.id)
+                write = self.remove_sensor_from_zone(zoneID, delDevice.id)
+                if write is not None:
+                    writes.append(write)
+        return None, writes
 
     def deviceUpdated(self, oldDevice, newDevice):
         indigo.PluginBase.deviceUpdated(self, oldDevice, newDevice)
-        if newDevice.id in self.watchList and oldDevice.onState != newDevice.onState:  # only care about onState changes
-            self.logger.debug(f"Watched Device updated: {newDevice.name} is now {newDevice.onState}")
-            for zone in self.watchList[newDevice.id]:
-                if zone not in indigo.devices:  # zone device deleted but still in the watch list
-                    self.logger.debug(f"Watched Device updated: zone {zone} no longer exists, skipping")
+        if oldDevice.name != newDevice.name or oldDevice.supportsOnState != newDevice.supportsOnState:
+            self.index_candidate(newDevice)  # the dialogs' index lives on Indigo's thread, not the worker's
+        if newDevice.id in self.watchList or newDevice.id in self.zones:
+            self.submit(self.device_updated, oldDevice, newDevice, self.clock())
+
+    def device_updated(self, oldDevice, newDevice, now):
+        # deviceUpdated, on the worker.  now is when Indigo delivered the event, so the eventToTransition latency
+        # includes the time it spent queued.
+        zone = self.zones.get(newDevice.id, None)
+        shadow = self.shadows.get(newDevice.id, None)
+        if shadow is not None:
+            shadow.name = newDevice.name
+            if zone is None:  # a running zone's onState is what it last wrote, which the server's echo can lag behind
+                shadow.onState = bool(newDevice.onState)
+        if zone is not None:
+            zone.name = newDevice.name
+        if zone is not None and not self.didDeviceCommPropertyChange(oldDevice, newDevice):
+            props = dict(newDevice.pluginProps)
+            if props != zone.props:  # edited in the dialog; the update actions have already applied theirs
+                self.apply_props(zone, newDevice, props)
+        if newDevice.id not in self.watchList:
+            return
+        if oldDevice.onState == newDevice.onState:  # only care about onState changes
+            self.count(None, "eventsIgnored")
+            return
+        self.trace(None, "Watched Device updated: %s is now %s", newDevice.name, newDevice.onState)
+        if self.traceFile is not None:
+            self.traceFile.write(f"{now - self.traceStart:.3f} {newDevice.id} {int(bool(newDevice.onState))}\n")
+        if newDevice.id in self.zones:
+            # a nested zone: propagate_transition pushed its change into these zones as it made it, and the
+            # server's echo can lag behind it - applying a stale one would flip them back
+            for zoneID in self.watchList[newDevice.id]:
+                self.count(self.zones.get(zoneID, None), "eventsIgnored")
+            return
+        for zoneID in self.watchList[newDevice.id]:
+            zone = self.zones.get(zoneID, None)
+            zoneDevice = self.zone_device(zoneID)
+            if zone is None or zoneDevice is None:  # zone deleted or stopped but still in the watch list
+                self.trace(None, "Watched Device updated: zone %s is not running, skipping", zoneID)
+                self.count(None, "eventsIgnored")
+                continue
+            self.update_member_state(zone, newDevice.id, bool(newDevice.onState))
+            self.count(zone, "eventsReceived")
+            zone.eventTime = now
+            if zone.coalesce > 0.0:
+                self.coalesce_event(zone, newDevice.onState)
+            else:
+                self.check_sensors(zoneDevice, newDevice.onState)
+
+    def coalesce_event(self, zone, sensorState):
+        # Fold a sensor event into the zone's pending evaluation rather than evaluating it now, so a burst of
+        # events - a scene, an "all on" - costs one evaluation and one set of writes.  The member count is already
+        # up to date; an activation still gets its own time hack, stamped when it happened.
+        if zone.typeId == 'activityZone' and sensorState and zone.members:
+            self.record_activation(zone)
+        zone.burstEvents += 1
+        if zone.coalesceTimer is None:
+            zone.coalesceTimer = self.clock() + zone.coalesce
+            self.schedule_timer("coalesce", zone, zone.coalesceTimer)
+
+    def coalesced_evaluation(self, zoneDevice, zone):
+        events, zone.burstEvents, zone.coalesceTimer = zone.burstEvents, 0, None
+        writes = zone.stats["writes"]
+        self.check_sensors(zoneDevice, False)
+        self.count(zone, "bursts")
+        self.count(zone, "burstEvents", events)
+        self.count(zone, "burstWrites", zone.stats["writes"] - writes)
+        self.trace(zone, "%s: coalesced %d sensor event(s) into one evaluation, %d state write(s)", zone.name, events, zone.stats["writes"] - writes)
+
+    def zone_rank(self, zoneID, visiting=None):
+        # 0 for a zone with no nested zones among its sensors, otherwise one more than its deepest nested zone.
+        # Evaluating zones in rank order means every zone sees all of its nested zones settled first.  Cached,
+        # and kept up to date by rerank as the nesting changes.
+        rank = self.zoneRanks.get(zoneID, None)
+        if rank is not None:
+            return rank
+        visiting = visiting or set()
+        visiting.add(zoneID)
+        rank = 0
+        for sensorID in self.zoneWatches.get(zoneID, ()):
+            if sensorID in self.zoneWatches and sensorID not in visiting:  # a running zone; a cycle is cut here
+                rank = max(rank, self.zone_rank(sensorID, visiting) + 1)
+        visiting.discard(zoneID)
+        self.zoneRanks[zoneID] = rank
+        return rank
+
+    def rerank(self, zoneID):
+        # A zone started or stopped, or gained or lost a nested zone.  A rank depends only on what is nested
+        # below it, so the zones that can move are this one and those it is nested in, transitively: recompute
+        # just those, and leave every other zone's rank cached.
+        stale, stack = set(), [zoneID]
+        while stack:
+            affected = stack.pop()
+            if affected not in stale:  # a loop is walked once
+                stale.add(affected)
+                stack.extend(self.watchList.get(affected, ()))
+        for affected in stale:
+            self.zoneRanks.pop(affected, None)
+        for affected in stale:
+            if affected in self.zoneWatches:
+                self.zone_rank(affected)
+        self.count(None, "zonesReranked", len(stale))
+
+    def propagate_transition(self, zoneID, occupied):
+        # A zone that other zones use as a sensor changed state.  Rather than wait for the server to send its
+        # deviceUpdated, push the change straight into those zones and evaluate them, lowest rank first, along
+        # with whatever they in turn change: one pass for the whole chain.  When the deviceUpdated does arrive it
+        # finds the change already counted and is ignored.  Called once the zone has finished its own transition -
+        # state, image, history and triggers - so the zones above it always come after it and see it settled.
+        if zoneID not in self.watchList:
+            return
+        queue = getattr(self.propagation, "queue", None)
+        running = queue is not None
+        if not running:
+            queue = self.propagation.queue = []
+            self.propagation.done = {}  # zone id -> True once evaluated in this pass, False while queued
+        done = self.propagation.done
+        try:
+            for parentID in self.watchList.get(zoneID, ()):
+                parent = self.zones.get(parentID, None)
+                if parent is None or not self.update_member_state(parent, zoneID, occupied):
                     continue
-                self.check_sensors(indigo.devices[zone], newDevice.onState)
+                self.count(parent, "eventsPropagated")
+                if parent.typeId == 'activityZone' and occupied:
+                    self.record_activation(parent)
+                if parentID not in done:
+                    done[parentID] = False
+                    heapq.heappush(queue, (self.zone_rank(parentID), parentID))
+                elif done[parentID]:
+                    self.warn_limited(parent, "loop", "%s: nested zones form a loop, not re-evaluating it", parent.name)
+            if running:  # the pass further up the stack evaluates them
+                return
+            while queue:
+                _, parentID = heapq.heappop(queue)
+                done[parentID] = True
+                parentDevice = self.zone_device(parentID)
+                if parentDevice is not None:
+                    self.check_sensors(parentDevice, False)
+        finally:
+            if not running:
+                self.propagation.queue = self.propagation.done = None
 
     def runConcurrentThread(self):
+        # The worker: applies the queued events and fires the timers, then sleeps until the earliest pending
+        # deadline or until an event, schedule_timer or cancel_timers wakes it.  With nothing queued and no timers
+        # pending the thread costs nothing, however many zones there are.
+        self.worker = threading.get_ident()
         try:
             while True:
-                for zoneDevID in list(self.zoneList):  # copy, the list can change while we're working through it
-                    if zoneDevID not in indigo.devices:  # zone device deleted, don't take the whole thread down
-                        self.logger.debug(f"runConcurrentThread: zone device {zoneDevID} no longer exists, skipping")
-                        continue
-                    zoneDevice = indigo.devices[zoneDevID]
-
-                    # single .get() rather than "in" then subscript: the main thread cancels these from
-                    # deviceStopComm and forget_zone, and losing that race used to raise a KeyError that escaped
-                    # the StopThread handler below and killed the timer thread for every zone
-                    delayTimer = self.delayTimers.get(zoneDevID, None)
-                    if delayTimer:
-                        timerEnd, occupied = delayTimer
-                        duration = timerEnd - time.time()
-                        zoneDevice.updateStateOnServer(key='delay_timer', value=duration)
-                        zoneDevice.updateStateOnServer(key='onOffState', value=zoneDevice.onState, uiValue=f"Delay {duration:.1f}")
-                        if timerEnd <= time.time():
-                            self.delay_timer_complete(zoneDevice, occupied)
-
-                    forceTimer = self.forceTimers.get(zoneDevID, None)
-                    if forceTimer:
-                        timerEnd = forceTimer
-                        duration = timerEnd - time.time()
-                        zoneDevice.updateStateOnServer(key='force_off_timer', value=duration)
-                        zoneDevice.updateStateOnServer(key='onOffState', value=zoneDevice.onState, uiValue=f"Force Off {duration:.1f}")
-                        if timerEnd <= time.time():
-                            self.force_off_timer_complete(zoneDevice)
-
-                    expired = time.time() - float(zoneDevice.pluginProps.get("activityWindow", 0))
-                    if zoneDevID in self.activityZoneList:  # remove expired time hacks
-                        if len(self.activityZoneList[zoneDevID]) and (self.activityZoneList[zoneDevID][0] < expired):
-                            self.activityZoneList[zoneDevID].pop(0)
-                            self.logger.debug(f"{zoneDevice.name}: check_sensors activityZone, deleted time hack")
-                            self.check_sensors(zoneDevice, False)
-
-                self.sleep(1.0)
+                self.wakeup.clear()
+                self.drain_events()
+                timeout = self.run_timers()
+                self.sleep(0)  # raises StopThread once Indigo asks the thread to stop
+                self.wakeup.wait(timeout)
         except self.StopThread:
             pass
+        finally:
+            with self.queueLock:  # whoever is still waiting gets an answer; from here on callers run inline
+                self.drain_events()
+                self.worker = None
+
+    def enqueue(self, function, args, reply):
+        # Queue a call for the worker, returning False if the caller should just make it: there is no worker, or
+        # the caller is the worker.
+        with self.queueLock:
+            if self.worker is None or self.worker == threading.get_ident():
+                return False
+            self.events.append((function, args, reply, time.perf_counter()))
+        self.wakeup.set()
+        return True
+
+    def submit(self, function, *args):
+        # Hand a change to the worker without waiting for it - the sensor event path.
+        if not self.enqueue(function, args, None):
+            function(*args)
+
+    def call(self, function, *args, **kwargs):
+        # Run function on the worker and wait for it, returning what it returns and raising what it raises.  A
+        # worker stuck on the server, which may itself be waiting on this thread, gets CALL_TIMEOUT: after that
+        # the caller gets None and the call is left to run whenever the worker gets to it.  Hence nothing run
+        # through here writes props to the server, see persist_props.
+        if kwargs:
+            function = functools.partial(function, **kwargs)
+        reply = [threading.Event(), None, None]  # done, result, exception
+        if not self.enqueue(function, args, reply):
+            return function(*args)
+        if not reply[0].wait(CALL_TIMEOUT):
+            self.count(None, "callTimeouts")
+            self.logger.error(f"{getattr(function, '__name__', function)}: no answer from the worker thread after "
+                              f"{CALL_TIMEOUT:.0f}s, not waiting for it")
+            return None
+        if reply[2] is not None:
+            raise reply[2]
+        return reply[1]
+
+    def drain_events(self):
+        # Apply everything queued so far, oldest first, as one batch.  Only the worker calls this (or the thread
+        # that stands in for it while it isn't running), which is what makes it the zone state's one writer.
+        drained = 0
+        while self.events:
+            function, args, reply, queued = self.events.popleft()
+            self.histograms["queueWait"].add(time.perf_counter() - queued)
+            try:
+                result = function(*args)
+            except Exception as exc:  # noqa: BLE001 - one bad event mustn't take the worker down
+                if reply is None:
+                    self.logger.exception(f"{getattr(function, '__name__', function)}: unhandled error")
+                else:
+                    reply[2] = exc
+            else:
+                if reply is not None:
+                    reply[1] = result
+            if reply is not None:
+                reply[0].set()
+            drained += 1
+        if drained:
+            self.count(None, "queueDrains")
+            self.count(None, "queuedEvents", drained)
+        return drained
+
+    def schedule_timer(self, kind, zone, deadline):
+        heapq.heappush(self.timerHeap, (deadline, next(self.timerSeq), kind, zone.id))
+        self.count(zone, "timersArmed." + kind)
+        self.wakeup.set()
+
+    def arm_delay_timer(self, zone, deadline, occupied):
+        zone.delayTimer = (deadline, occupied)
+        self.counting.add(zone.id)
+        self.schedule_timer("delay", zone, deadline)
+        self.snapshot_changed(zone)
+
+    def arm_force_timer(self, zone, deadline):
+        zone.forceTimer = deadline
+        self.counting.add(zone.id)
+        self.schedule_timer("force", zone, deadline)
+        self.snapshot_changed(zone)
+
+    def end_delay_timer(self, zone, fired=False):
+        # Clear the zone's delay timer, returning it if one was pending.  Its heap entry goes stale.
+        delayTimer, zone.delayTimer = zone.delayTimer, None
+        if zone.forceTimer is None:
+            self.counting.discard(zone.id)
+        if delayTimer is not None:
+            self.snapshot_changed(zone)
+            if not fired:
+                self.count(zone, "timersCancelled.delay")
+        return delayTimer
+
+    def end_force_timer(self, zone, fired=False):
+        forceTimer, zone.forceTimer = zone.forceTimer, None
+        if zone.delayTimer is None:
+            self.counting.discard(zone.id)
+        if forceTimer is not None:
+            self.snapshot_changed(zone)
+            if not fired:
+                self.count(zone, "timersCancelled.force")
+        return forceTimer
+
+    def cancel_timers(self, zone):
+        # Drop both timers for a zone, returning which ones were actually pending.
+        delayTimer = self.end_delay_timer(zone)
+        forceTimer = self.end_force_timer(zone)
+        zone.activityTimer = zone.scoreTimer = zone.statsTimer = None
+        if delayTimer or forceTimer:
+            self.wakeup.set()  # so a countdown that no longer exists stops being refreshed
+        return delayTimer, forceTimer
+
+    def run_timers(self):
+        # One pass of the timer thread: fire everything that is due, refresh the countdowns still running, and
+        # return how long the thread may sleep (None for "until woken").
+        now = self.clock()
+        started = time.perf_counter()  # the tick's real cost, whatever the clock says
+        self.count(None, "ticks")
+        while self.timerHeap and self.timerHeap[0][0] <= now:
+            deadline, _, kind, zoneID = heapq.heappop(self.timerHeap)
+            self.timer_due(kind, zoneID, deadline)
+        self.drop_stale_timers()
+
+        wake = self.timerHeap[0][0] if self.timerHeap else None
+        if self.counting and self.clock() - now > COUNTDOWN_BUDGET:
+            # the countdowns are cosmetic, so they are the first thing to go when the real work is running behind
+            self.count(None, "countdownsShed")
+            self.trace(None, "run_timers: behind by %.2fs, skipped %d countdown(s)", self.clock() - now, len(self.counting))
+            wake = min(wake, self.clock() + 1.0) if wake else self.clock() + 1.0
+        else:
+            for zoneID in list(self.counting):  # copy, a refresh can end a timer
+                zone = self.zones.get(zoneID, None)
+                nextChange = self.refresh_countdown(zone) if zone else None
+                if nextChange is not None:
+                    wake = nextChange if wake is None else min(wake, nextChange)
+
+        self.histograms["tick"].add(time.perf_counter() - started)
+        return None if wake is None else max(0.0, wake - self.clock())
+
+    def timer_live(self, kind, zoneID, deadline):
+        # Whether a heap entry is still the timer armed for it - timers are cancelled and re-armed at will and the
+        # heap is never searched.  The zone may have been stopped or deleted since it was pushed.
+        if kind == "snapshot":
+            return deadline == self.snapshotDue
+        zone = self.zones.get(zoneID, None)
+        if zone is None:
+            return False
+        if kind == "delay":
+            return zone.delayTimer is not None and zone.delayTimer[0] == deadline
+        return getattr(zone, TIMER_FIELDS[kind]) == deadline
+
+    def drop_stale_timers(self):
+        # Pop the cancelled and re-armed entries off the top of the heap, so the thread sleeps until the earliest
+        # timer that will actually fire rather than waking for a dead one.  Those further down are swept out in
+        # one go once the heap has doubled since the last sweep, which keeps a sensor that re-arms its zone's
+        # timer on every event from growing the heap without bound.
+        while self.timerHeap:
+            deadline, _, kind, zoneID = self.timerHeap[0]
+            if self.timer_live(kind, zoneID, deadline):
+                break
+            heapq.heappop(self.timerHeap)
+            self.count(None, "timersDiscarded")
+        if len(self.timerHeap) >= self.timerCompactAt:
+            live = [entry for entry in self.timerHeap if self.timer_live(entry[2], entry[3], entry[0])]
+            self.count(None, "timersDiscarded", len(self.timerHeap) - len(live))
+            heapq.heapify(live)
+            self.timerHeap = live
+            self.timerCompactAt = max(TIMER_COMPACT, 2 * len(live))
+
+    def timer_due(self, kind, zoneID, deadline):
+        # A heap entry came due.  It only counts if it is still live, see timer_live; the zone may have been
+        # stopped or deleted since, by an event the worker applied earlier.
+        if not self.timer_live(kind, zoneID, deadline):
+            return
+        if kind == "snapshot":
+            self.save_snapshot()
+            return
+        zone = self.zones[zoneID]
+        zoneDevice = self.zone_device(zoneID)
+        if zoneDevice is None:  # zone device deleted, don't take the whole thread down
+            self.trace(zone, "timer_due: zone device %s no longer exists, skipping", zoneID)
+            return
+
+        self.timer_fired(zone, kind, deadline)
+        if kind == "delay":
+            self.delay_timer_complete(zoneDevice, zone.delayTimer[1])
+        elif kind == "force":
+            self.force_off_timer_complete(zoneDevice)
+        elif kind == "activity":
+            zone.activityTimer = None
+            self.expire_activity(zoneDevice)
+        elif kind == "coalesce":
+            self.coalesced_evaluation(zoneDevice, zone)
+        elif kind == "score":
+            zone.scoreTimer = None
+            self.check_sensors(zoneDevice, False)
+        elif kind == "stats":
+            zone.statsTimer = None
+            self.publish_activity_rate(zone, zoneDevice)
+
+    def timer_fired(self, zone, kind, deadline):
+        self.count(zone, "timersFired." + kind)
+        self.histograms["timerLateness"].add(self.clock() - deadline)
+
+    @staticmethod
+    def valid_countdown_mode(mode, default):
+        mode = str(mode)
+        return mode if mode in COUNTDOWN_MODES else default
+
+    @staticmethod
+    def countdown_step(remaining, mode):
+        # The value a countdown shows with this much time left, and the time left at which that value next
+        # changes (None once it reads 0).  Returns None if the mode doesn't display countdowns at all.
+        if mode == "0":
+            return None
+        if remaining <= 0:
+            return 0, None
+        if mode == "thresholds":
+            lower = 0
+            for threshold in COUNTDOWN_THRESHOLDS:
+                if remaining <= threshold:
+                    return threshold, lower
+                lower = threshold
+            step = COUNTDOWN_THRESHOLDS[-1]
+        else:
+            step = int(mode)
+        shown = math.ceil(remaining / step) * step
+        return shown, shown - step
+
+    def refresh_countdown(self, zone, zoneDevice=None):
+        # Bring the displayed countdowns up to date, sending only the values that changed since the last write.
+        # Returns the time at which the display next needs changing, or None.  The device is only fetched when
+        # there is something to write.
+        mode = zone.countdownMode or self.countdownRefresh
+        now = self.clock()
+
+        updates = {}
+        label = None
+        nextChange = None
+        for key, prefix, deadline in (('delay_timer', "Delay", zone.delayTimer[0] if zone.delayTimer else None),
+                                      ('force_off_timer', "Force Off", zone.forceTimer)):
+            step = self.countdown_step(deadline - now, mode) if deadline else None
+            if step is None:
+                continue
+            value, lower = step
+            if lower is not None:
+                nextChange = deadline - lower if nextChange is None else min(nextChange, deadline - lower)
+            if label is None:  # the delay is the more imminent of the two, so it gets the uiValue
+                label = f"{prefix} {value}"
+            if zone.shown.get(key) != value:
+                updates[key] = value
+        if label is not None and zone.shown.get('ui') != label:
+            updates['ui'] = label
+
+        if updates:
+            if zoneDevice is None:
+                zoneDevice = self.zone_device(zone.id)
+                if zoneDevice is None:
+                    return None
+            for key in ('delay_timer', 'force_off_timer'):
+                if key in updates:
+                    self.update_state(zone, zoneDevice, key=key, value=updates[key])
+            if 'ui' in updates:
+                self.update_state(zone, zoneDevice, key='onOffState', value=zoneDevice.onState, uiValue=updates['ui'])
+            zone.shown.update(updates)
+        return nextChange
+
+    def clear_countdown(self, zone, zoneDevice, key):
+        # A timer ended or was cancelled: zero its state, unless that is what is already showing.  The uiValue is
+        # forgotten, since whoever called this is about to overwrite it.
+        zone.shown.pop('ui', None)
+        if zone.shown.get(key) != 0:
+            self.update_state(zone, zoneDevice, key=key, value=0.0)
+            zone.shown[key] = 0
+
+    def expire_activity(self, zoneDevice):
+        # Drop the time hacks that have aged out of the window, then re-arm for the next oldest one.
+        zone = self.zones.get(zoneDevice.id, None)
+        if zone is None:  # stopped, deviceStartComm re-arms it
+            return
+        expired = zone.expire_activity(self.clock())
+        self.trace(zone, "%s: expire_activity, deleted %d time hack(s), %d left", zone.name, expired, len(zone.activity))
+        self.check_sensors(zoneDevice, False)
+        self.schedule_activity_expiry(zone)
 
+    def schedule_activity_expiry(self, zone):
+        if not zone.activity or zone.activityTimer is not None:
+            return
+        zone.activityTimer = zone.activity[0] + zone.activityWindow
+        self.schedule_timer("activity", zone, zone.activityTimer)
+
+    @on_worker
     def deviceStartComm(self, device):
+        zone = self.zones.get(device.id, None)
+        if zone is not None and zone.props == dict(device.pluginProps):
+            # already running as configured - a zone whose props reconcile_zones rewrote was started by that
+            # write, and starting it again would only repeat the same writes
+            self.logger.debug(f"{device.name}: already running, not restarting")
+            self.cold_start_step(device.id, 0.0, 0.0, 0.0)
+            return
         self.logger.info(f"{device.name}: Starting Device")
+        started = time.perf_counter()
+        skipped = 0
 
-        if device.deviceTypeId == 'area':
+        if device.deviceTypeId not in ZONE_STATES:
+            self.logger.warning(f"{device.name}: deviceStartComm: Invalid device type: {device.deviceTypeId}")
+            self.cold_start_step(device.id, 0.0, 0.0, 0.0, started=False)  # or the startup report waits for it forever
+            return
+        if device.id in self.shadows:  # Indigo's copy is as current as it gets
+            self.shadows[device.id].refresh(device)
+        else:
+            self.shadows[device.id] = DeviceShadow(device)
 
+        # every server write here is skipped when the server already has that value, which on a plain restart
+        # is all of them
+        if device.deviceTypeId == 'area':
             sharedProps = device.sharedProps
-            sharedProps["sqlLoggerIgnoreStates"] = "delay_timer,force_off_timer"
-            device.replaceSharedPropsOnServer(sharedProps)
+            if sharedProps.get("sqlLoggerIgnoreStates", None) != "delay_timer,force_off_timer":
+                sharedProps["sqlLoggerIgnoreStates"] = "delay_timer,force_off_timer"
+                device.replaceSharedPropsOnServer(sharedProps)
+            else:
+                skipped += 1
 
-            # deliberately not forcing onOffState False here: a props edit restarts the device, and clearing the
-            # state first makes check_sensors see previous == False, so the zoneUnoccupied trigger never fires
-            device.updateStateImageOnServer(
-                indigo.kStateImageSel.MotionSensorTripped if device.onState else indigo.kStateImageSel.MotionSensor)
+        # deliberately not forcing onOffState False here: a props edit restarts the device, and clearing the
+        # state first makes check_sensors see previous == False, so the zoneUnoccupied trigger never fires
+        image = indigo.kStateImageSel.MotionSensorTripped if device.onState else indigo.kStateImageSel.MotionSensor
+        if device.displayStateImageSel != image:
+            device.updateStateImageOnServer(image)
+        else:
+            skipped += 1
 
+        if not all(state in device.states for state in ZONE_STATES[device.deviceTypeId]):  # new states from an upgrade
             device.stateListOrDisplayStateIdChanged()
-
-            sensorsInZone = self.sensor_ids_for_zone(device)  # mirrors the props; check_sensors filters to live devices
-            self.logger.debug(f"{device.name}: Zone {device.id} uses sensor devices: {sensorsInZone}")
-
-            self.add_zone_to_watch_list(device, sensorsInZone)
-            self.zoneList[device.id] = sensorsInZone
-
-        elif device.deviceTypeId == 'activityZone':
-
-            device.updateStateImageOnServer(
-                indigo.kStateImageSel.MotionSensorTripped if device.onState else indigo.kStateImageSel.MotionSensor)
-
-            sensorsInZone = self.sensor_ids_for_zone(device)
-            self.logger.debug(f"{device.name}: Zone {device.id} uses sensor devices: {sensorsInZone}")
-
-            self.add_zone_to_watch_list(device, sensorsInZone)
-            self.zoneList[device.id] = sensorsInZone  # list of indigo device IDs that are sensors for this zone
-            # setdefault, not []: a props edit restarts the device, and a plain reset would throw away the
-            # activity history contributed by the sensors that are still members
-            self.activityZoneList.setdefault(device.id, [])  # list of time hacks that sensor on updates occurred
-
         else:
-            self.logger.warning(f"{device.name}: deviceStartComm: Invalid device type: {device.deviceTypeId}")
-            return
+            skipped += 1
+
+        sensorsInZone = self.sensor_ids_for_zone(device)  # mirrors the props; check_sensors filters to live devices
+        self.logger.debug(f"{device.name}: Zone {device.id} uses sensor devices: {sensorsInZone}")
+
+        zone = Zone(device, sensorsInZone, self.zoneStats.setdefault(device.id, collections.Counter()))
+        self.watch_sensors(device, sensorsInZone)
+        resync = time.perf_counter()
+        self.resync_members(zone)
+        resync = time.perf_counter() - resync
+
+        if device.deviceTypeId == 'activityZone':
+            # a props edit restarts the device, and starting from an empty history would throw away the activations
+            # contributed by the sensors that are still members
+            zone.activity = zone.activity_history(self.parkedActivity.pop(device.id, ()))
+            zone.expire_activity(self.clock())
+        saved = self.restored.pop(device.id, None)
+        if saved is not None:
+            self.restore_zone(zone, saved)
+        self.zones[device.id] = zone
+        self.schedule_activity_expiry(zone)
+        if zone.id in self.snapshotEntries or zone.activity:  # what the last snapshot said no longer applies
+            self.snapshot_changed(zone)
 
         # update the state
+        evaluate = time.perf_counter()
         self.check_sensors(device, False)
-
+        evaluate = time.perf_counter() - evaluate
+        if self.coldStart is not None:
+            self.coldStart["skipped"] += skipped
+        self.cold_start_step(device.id, time.perf_counter() - started, resync, evaluate)
+
+    def cold_start_step(self, zoneID, duration, resync, evaluate, started=True):
+        report = self.coldStart
+        if report is None or zoneID not in report["pending"]:
+            return
+        report["pending"].discard(zoneID)
+        report["zones"] += 1 if started else 0
+        report["start"] += duration
+        report["resync"] += resync
+        report["evaluate"] += evaluate
+        if not report["pending"]:
+            self.cold_start_done()
+
+    @on_worker
     def deviceStopComm(self, device):
         self.logger.info(f"{device.name}: Stopping Device")
 
-        # unregister from the watch lists using what was actually registered, not a re-read of the props - a
-        # props edit is what triggered the stop, so the props no longer describe what deviceStartComm registered
-        registered = self.zoneList.pop(device.id, None)
-        if registered is None:
-            registered = self.sensor_ids_for_zone(device)
-        self.remove_zone_from_watch_list(device, registered)
+        # unregister what was actually registered, not a re-read of the props - a props edit is what triggered the
+        # stop, so the props no longer describe what deviceStartComm registered
+        self.unwatch_zone(device.id)
+        zone = self.zones.pop(device.id, None)
+        if zone is None:
+            return
 
-        # cancel any timers and clear the countdown they left on display.  This is the teardown for every stop,
-        # including the restart a props edit causes, so it has to reset the displayed state as well as the dicts.
-        if self.delayTimers.pop(device.id, None):
-            device.updateStateOnServer(key='delay_timer', value=0.0)
-        if self.forceTimers.pop(device.id, None):
-            device.updateStateOnServer(key='force_off_timer', value=0.0)
-        if device.deviceTypeId == 'area':
-            device.updateStateOnServer(key='onOffState', value=device.onState, uiValue="")
+        # what the zone was doing goes into the snapshot before it's torn down: Indigo stops every device before
+        # the plugin's shutdown, and it's this state, not the cancelled one, that the next startup should resume
+        if zone.id in self.snapshotDirty:
+            self.encode_snapshot_entry(zone)
 
-        # activityZoneList deliberately survives a stop, see deviceStartComm; forget_zone clears it for good
+        # cancel any timers and clear the countdown they left on display.  This is the teardown for every stop,
+        # including the restart a props edit causes, so it has to reset the displayed state as well as the Zone.
+        delayTimer, forceTimer = self.cancel_timers(zone)
+        if delayTimer:
+            self.clear_countdown(zone, device, 'delay_timer')
+        if forceTimer:
+            self.clear_countdown(zone, device, 'force_off_timer')
+        if delayTimer or forceTimer:  # only a running timer puts a countdown in the uiValue
+            self.update_state(zone, device, key='onOffState', value=device.onState, uiValue="")
+
+        # the activity history deliberately survives a stop, see deviceStartComm; forget_zone clears it for good
+        if zone.activity:
+            self.parkedActivity[device.id] = zone.activity
+        if device.id not in self.watchList:  # still wanted while another zone watches this one
+            self.shadows.pop(device.id, None)
+
+    def didDeviceCommPropertyChange(self, origDev, newDev):
+        # Only a change of members needs the stop/start; anything else is applied to the running zone by
+        # apply_props, from deviceUpdated or the update actions.
+        return origDev.pluginProps.get("sensorDevices", "") != newDev.pluginProps.get("sensorDevices", "")
+
+    def apply_props(self, zone, zoneDevice, props):
+        # Take new settings into a running zone without restarting it.  A pending delay or force-off keeps the time
+        # it started and runs for the new length instead - shortened past now, it completes on the next tick - and
+        # the zone is only re-evaluated if what makes it occupied changed.
+        delays = (zone.onDelay, zone.offDelay, zone.forceOff)
+        rules = (zone.onSensorsOnOff, zone.onAnyAll, zone.activityCount, zone.activityWindow, zone.onScore, zone.offScore)
+        weights, statsEvery = zone.weights, zone.statsEvery
+        zone.name = zoneDevice.name
+        zone.configure(props)
+        self.logger.debug(f"{zone.name}: settings applied in place")
+
+        if zone.delayTimer is not None:
+            deadline, occupied = zone.delayTimer
+            before, after = (delays[0], zone.onDelay) if occupied else (delays[1], zone.offDelay)
+            if after != before:
+                self.arm_delay_timer(zone, deadline - before + after, occupied)
+        if zone.forceTimer is not None and zone.forceOff != delays[2]:
+            if zone.forceOff > 0:
+                self.arm_force_timer(zone, zone.forceTimer - delays[2] + zone.forceOff)
+            else:
+                self.end_force_timer(zone)
+                self.clear_countdown(zone, zoneDevice, 'force_off_timer')
+
+        if zone.statsTimer is not None and zone.statsEvery != statsEvery:  # the next publish moves to the new cadence
+            zone.statsTimer = None
+            if zone.statsEvery > 0.0:
+                zone.statsTimer = self.clock()
+                self.schedule_timer("stats", zone, zone.statsTimer)
+
+        reweighed = zone.typeId == 'scoreZone' and zone.weights != weights
+        if reweighed:
+            self.resync_members(zone)  # rebuilt, rather than re-weighing what is decaying
+        if reweighed or rules != (zone.onSensorsOnOff, zone.onAnyAll, zone.activityCount, zone.activityWindow, zone.onScore, zone.offScore):
+            if zone.typeId == 'activityZone':  # a new window moves the next expiry
+                zone.expire_activity(self.clock())
+                zone.activityTimer = None
+                self.schedule_activity_expiry(zone)
+            self.check_sensors(zoneDevice, False)
+        if zone.id in self.counting:
+            self.refresh_countdown(zone, zoneDevice)
+        self.wakeup.set()
 
     def check_sensors(self, zoneDevice, sensorState):
 
-        if zoneDevice.deviceTypeId == 'area':
+        zone = self.zones.get(zoneDevice.id, None)
+        if zone is None:  # zone was stopped out from under us
+            self.trace(None, "%s: check_sensors, zone is not running, skipping", zoneDevice.name)
+            return
+        self.count(zone, "evaluations")
+
+        if zone.typeId == 'area':
 
-            sensors = self.live_sensors(zoneDevice)
-            if not sensors:
+            liveCount = len(zone.members)
+            if not liveCount:
                 # all([]) is True, so an 'all' zone would report occupied forever.  Cancel a pending delay, whose
                 # occupied value was computed from sensors that are now gone, but leave any force-off timer to
                 # fire - it sets the zone off unconditionally and is the only thing left that can recover it.
-                self.logger.warning(f"{zoneDevice.name}: check_sensors, no valid sensor devices, leaving zone state unchanged")
-                if self.delayTimers.pop(zoneDevice.id, None):
-                    zoneDevice.updateStateOnServer(key='delay_timer', value=0.0)
-                    zoneDevice.updateStateOnServer(key='onOffState', value=zoneDevice.onState, uiValue="")
+                self.warn_limited(zone, "no sensors", "%s: check_sensors, no valid sensor devices, leaving zone state unchanged", zone.name)
+                if self.end_delay_timer(zone):
+                    self.clear_countdown(zone, zoneDevice, 'delay_timer')
+                    self.update_state(zone, zoneDevice, key='onOffState', value=zoneDevice.onState, uiValue="")
                 return
 
-            onSensorsOnOff = zoneDevice.pluginProps.get("onSensorsOnOff", "on")
-            if onSensorsOnOff == 'change':
-                occupiedList = [True for x in sensors]
-            elif onSensorsOnOff == 'on':
-                occupiedList = [indigo.devices[x].onState for x in sensors]
+            # how many live members are in the state that counts as occupied
+            if zone.onSensorsOnOff == 'change':
+                matching = liveCount
+            elif zone.onSensorsOnOff == 'on':
+                matching = zone.onCount
             else:
-                occupiedList = [not indigo.devices[x].onState for x in sensors]
+                matching = liveCount - zone.onCount
 
-            onAnyAll = zoneDevice.pluginProps.get("onAnyAll", "all")
-            if onAnyAll == 'all':
-                occupied = all(occupiedList)
+            if zone.onAnyAll == 'all':
+                occupied = matching == liveCount
             else:
-                occupied = any(occupiedList)
+                occupied = matching > 0
 
             previous = zoneDevice.onState
 
-            self.logger.debug(
-                f"{zoneDevice.name}: check_sensors, onSensorsOnOff = {onSensorsOnOff}, onAnyAll = {onAnyAll}, sensors: {sensors}")
-
-            if occupied:
-                delay = float(zoneDevice.pluginProps.get("onDelayValue", "0"))
+            self.trace(zone, "%s: check_sensors, onSensorsOnOff = %s, onAnyAll = %s, %d of %d sensors match",
+                       zone.name, zone.onSensorsOnOff, zone.onAnyAll, matching, liveCount)
+
+            delay = zone.onDelay if occupied else zone.offDelay
+
+            self.trace(zone, "%s: check_sensors, occupied = %s, previous = %s, delay = %s", zone.name, occupied, previous, delay)
+
+            pending = zone.delayTimer
+            if pending is not None and pending[1] == occupied:
+                # already heading there - re-arming would only slide the deadline later and rewrite the countdown
+                self.count(zone, "rearmsSkipped")
+                self.count(zone, "writesAvoided", 2)
+            elif occupied == previous:
+                # already there.  A timer heading the other way is for a condition that has since reverted.
+                if pending is not None:
+                    self.trace(zone, "%s: check_sensors, cancelling delay timer, zone is back to occupied = %s", zone.name, occupied)
+                    self.end_delay_timer(zone)
+                    self.clear_countdown(zone, zoneDevice, 'delay_timer')
+                    self.update_state(zone, zoneDevice, key='onOffState', value=previous, uiValue=("on" if previous else "off"))
+                else:
+                    self.count(zone, "writesAvoided", 2)
+            elif delay < IMMEDIATE_DELAY:
+                # too short to be worth a timer: waking the worker for it would take longer than the delay, and its
+                # countdown would only flash "Delay 0" on the way
+                if pending is not None and self.end_delay_timer(zone):
+                    self.clear_countdown(zone, zoneDevice, 'delay_timer')
+                self.count(zone, "immediateTransitions")
+                self.set_occupancy(zone, zoneDevice, occupied)
             else:
-                delay = float(zoneDevice.pluginProps.get("offDelayValue", "0"))
+                # start a timer with the specified delay
+                self.arm_delay_timer(zone, self.clock() + delay, occupied)
+                self.trace(zone, "%s: check_sensors, adding delay timer with value = %s, occupied = %s", zone.name, delay, occupied)
+
+            # force off only means something while the zone is, or is about to be, occupied.  With forceOffRearm each
+            # evaluation - i.e. each bit of sensor activity - starts it over; without, it runs out from when it started.
+            if zone.forceOff > 0.0 and (occupied or previous):
+                if zone.forceTimer is None or zone.forceOffRearm:
+                    self.arm_force_timer(zone, self.clock() + zone.forceOff)
+                    self.trace(zone, "%s: check_sensors, starting force timer with value = %s", zone.name, zone.forceOff)
+                else:
+                    self.count(zone, "rearmsSkipped")
+                    self.count(zone, "writesAvoided", 2)
 
-            self.logger.debug(f"{zoneDevice.name}: check_sensors, occupied = {occupied}, previous = {previous}, delay = {delay}")
+            self.refresh_countdown(zone, zoneDevice)  # only writes what changed
 
-            # start a timer with the specified delay
-            self.delayTimers[zoneDevice.id] = ((time.time() + delay), occupied)
-            self.logger.debug(f"{zoneDevice.name}: check_sensors, adding delay timer with value = {delay}, occupied = {occupied}")
-            zoneDevice.updateStateOnServer(key='onOffState', value=previous, uiValue=f"Delay {delay:.1f}")
-            zoneDevice.updateStateOnServer(key='delay_timer', value=delay)
+        elif zone.typeId == 'activityZone':
 
-            # str(): the updateOccupancyZone action copies the caller's value straight into the props, so a
-            # script passing an int leaves a non-string here and .isdigit() would raise AttributeError
-            forceOff = str(zoneDevice.pluginProps.get("forceOffValue", "0"))
-            if forceOff.isdigit() and float(forceOff) > 0.0:
-                self.forceTimers[zoneDevice.id] = time.time() + float(forceOff)
-                self.logger.debug(f"{zoneDevice.name}: check_sensors, starting force timer with value = {forceOff}")
-                zoneDevice.updateStateOnServer(key='onOffState', value=previous, uiValue=f"Force Off  {float(forceOff):.1f}")
-                zoneDevice.updateStateOnServer(key='force_off_timer', value=float(forceOff))
+            if not zone.members:  # same guard the 'area' branch gets
+                self.warn_limited(zone, "no sensors", "%s: check_sensors, no valid sensor devices, leaving zone state unchanged", zone.name)
+                return
 
-        elif zoneDevice.deviceTypeId == 'activityZone':
+            if sensorState:
+                self.record_activation(zone)
 
-            if zoneDevice.id not in self.activityZoneList:  # zone was stopped out from under us
-                self.logger.debug(f"{zoneDevice.name}: check_sensors activityZone, zone is not running, skipping")
-                return
+            previous = zoneDevice.onState
+            occupied = len(zone.activity) >= zone.activityCount
+            self.trace(zone, "%s: check_sensors activityZone, occupied = %s", zone.name, occupied)
+            if previous != occupied:
+                self.set_occupancy(zone, zoneDevice, occupied)
 
-            if not self.live_sensors(zoneDevice):  # same guard the 'area' branch gets
-                self.logger.warning(f"{zoneDevice.name}: check_sensors, no valid sensor devices, leaving zone state unchanged")
-                return
+        elif zone.typeId == 'scoreZone':
 
-            if sensorState:
-                # add another time hack to list
-                self.activityZoneList[zoneDevice.id].append(time.time())
-                self.logger.debug(f"{zoneDevice.name}: check_sensors activityZone, added time hack. {len(self.activityZoneList[zoneDevice.id])} total")
+            if not zone.members:  # same guard the 'area' branch gets
+                self.warn_limited(zone, "no sensors", "%s: check_sensors, no valid sensor devices, leaving zone state unchanged", zone.name)
+                return
 
+            # hysteresis: on once the score reaches onScore, off only once it drops below offScore
+            now = self.clock()
+            score = zone.score.value(now)
             previous = zoneDevice.onState
-            occupied = len(self.activityZoneList[zoneDevice.id]) >= int(zoneDevice.pluginProps.get("activityCount", 0))
-            self.logger.debug(f"{zoneDevice.name}: check_sensors activityZone, occupied = {occupied}")
+            occupied = score >= (zone.offScore if previous else zone.onScore)
+            self.trace(zone, "%s: check_sensors scoreZone, score = %.3f, occupied = %s", zone.name, score, occupied)
+            shown = round(score, 2)
+            if zone.shown.get('score') != shown:
+                self.update_state(zone, zoneDevice, key='score', value=shown)
+                zone.shown['score'] = shown
+            else:
+                self.count(zone, "writesAvoided")
             if previous != occupied:
-                zoneDevice.updateStateOnServer(key='onOffState', value=occupied, uiValue=("on" if occupied else "off"))
-                zoneDevice.updateStateImageOnServer(indigo.kStateImageSel.MotionSensorTripped if occupied else indigo.kStateImageSel.MotionSensor)
-                self.check_triggers(zoneDevice, occupied)
+                self.set_occupancy(zone, zoneDevice, occupied)
+            self.schedule_score_crossing(zone, occupied, now)
+
+    def schedule_score_crossing(self, zone, occupied, now):
+        # An occupied weighted zone whose score is held up by decaying members goes off on its own, once they have
+        # decayed far enough.  Every member change moves that moment; the timer for the old one goes stale.
+        crossing = zone.score.falls_below(zone.offScore, now) if occupied else None
+        deadline = None if crossing is None else crossing + SCORE_MARGIN
+        if deadline != zone.scoreTimer:
+            zone.scoreTimer = deadline
+            if deadline is not None:
+                self.schedule_timer("score", zone, deadline)
+
+    def record_activation(self, zone):
+        # add another time hack to list
+        now = self.clock()
+        zone.activity.append(now)
+        zone.rate.activation(now, zone.activityWindow or RATE_SPAN)
+        self.snapshot_changed(zone)
+        self.trace(zone, "%s: record_activation, added time hack. %d total", zone.name, len(zone.activity))
+        self.schedule_activity_expiry(zone)
+        if zone.statsTimer is None and zone.statsEvery > 0.0:  # the first activation in a while shows at once
+            zone.statsTimer = now
+            self.schedule_timer("stats", zone, now)
+
+    def publish_activity_rate(self, zone, zoneDevice):
+        # Write whichever of the rate figures changed, in one server call, and come back in statsEvery.  Once a zone
+        # has seen an activation that is for as long as it runs: secondsSinceActivation keeps counting.
+        if zone.statsEvery <= 0.0 or zone.rate.last is None:
+            return
+        now = self.clock()
+        figures = zone.rate.figures(now, zone.activityWindow or RATE_SPAN, max(1, zone.activityCount))
+        updates = {key: value for key, value in figures.items() if zone.shown.get(key) != value}
+        self.count(zone, "writesAvoided", len(figures) - len(updates))
+        if updates:
+            self.update_states(zone, zoneDevice, updates)
+            zone.shown.update(updates)
+        zone.statsTimer = now + zone.statsEvery
+        self.schedule_timer("stats", zone, zone.statsTimer)
+
+    def update_state(self, zone, device, key, value, uiValue=None):
+        # Every state write for a zone goes through here, so what the plugin costs the server can be counted, and
+        # so the shadow of a zone's onState is always what was last written.
+        self.count(zone, "writes")
+        self.count(zone, "stateWrites." + key)
+        if uiValue is None:
+            device.updateStateOnServer(key=key, value=value)
+        else:
+            device.updateStateOnServer(key=key, value=value, uiValue=uiValue)
+        if key == 'onOffState' and device.id in self.shadows:
+            self.shadows[device.id].onState = bool(value)
+
+    def update_states(self, zone, device, updates):
+        # Several states in one server call, counted as one write.  Not for onOffState, see update_state.
+        self.count(zone, "writes")
+        for key in updates:
+            self.count(zone, "stateWrites." + key)
+        device.updateStatesOnServer([{"key": key, "value": value} for key, value in updates.items()])
 
     def delay_timer_complete(self, device, occupied):
-        self.logger.debug(f"{device.name}: delay_timer_complete, occupied = {occupied}")
+        zone = self.zones.get(device.id, None)
+        self.trace(zone, "%s: delay_timer_complete, occupied = %s", device.name, occupied)
 
-        if self.delayTimers.pop(device.id, None) is None:  # pop, the main thread can cancel this underneath us
-            self.logger.warning(f"{device.name}: delay_timer_complete, no timer found")
+        if zone is None or self.end_delay_timer(zone, fired=True) is None:  # the main thread can cancel this underneath us
+            self.warn_limited(zone, "no timer", "%s: delay_timer_complete, no timer found", device.name)
+            return
 
-        previous = device.onState
+        self.clear_countdown(zone, device, 'delay_timer')
+        self.set_occupancy(zone, device, occupied)
 
-        device.updateStateOnServer(key='delay_timer', value=0.0)
-        device.updateStateOnServer(key='onOffState', value=occupied, uiValue=("on" if occupied else "off"))
+    def set_occupancy(self, zone, device, occupied):
+        # The end of every evaluated transition, whether a delay ran out or there was none to wait for.
+        previous = device.onState
+        self.update_state(zone, device, key='onOffState', value=occupied, uiValue=("on" if occupied else "off"))
         device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensorTripped if occupied else indigo.kStateImageSel.MotionSensor)
         if previous != occupied:
             self.check_triggers(device, occupied)
+            self.propagate_transition(device.id, occupied)
 
     def force_off_timer_complete(self, device):
-        self.logger.debug(f"{device.name}: force_off_timer_complete")
+        zone = self.zones.get(device.id, None)
+        self.trace(zone, "%s: force_off_timer_complete", device.name)
 
-        if self.forceTimers.pop(device.id, None) is None:  # pop, the main thread can cancel this underneath us
-            self.logger.warning(f"{device.name}: force_off_timer_complete, no timer found")
+        if zone is None or self.end_force_timer(zone, fired=True) is None:  # the main thread can cancel this underneath us
+            self.warn_limited(zone, "no timer", "%s: force_off_timer_complete, no timer found", device.name)
+            return
 
         previous = device.onState
 
-        device.updateStateOnServer(key='force_off_timer', value=0.0)
-        device.updateStateOnServer(key='onOffState', value=False, uiValue="")
+        self.clear_countdown(zone, device, 'force_off_timer')
+        self.update_state(zone, device, key='onOffState', value=False, uiValue="")
         device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
         if previous:
             self.check_triggers(device, False)
+            self.propagate_transition(device.id, False)
+
+    ########################################
+    # Snapshot of timers and activity
+    ########################################
+
+    def snapshot_changed(self, zone):
+        # A zone's timers or activity changed.  Only marks it: encoding and writing wait for save_snapshot.
+        self.snapshotDirty.add(zone.id)
+        self.schedule_snapshot()
+
+    def schedule_snapshot(self):
+        if self.snapshotDue is None:
+            self.snapshotDue = self.clock() + SNAPSHOT_INTERVAL
+            heapq.heappush(self.timerHeap, (self.snapshotDue, next(self.timerSeq), "snapshot", None))
+            self.wakeup.set()
+
+    def encode_snapshot_entry(self, zone):
+        self.snapshotDirty.discard(zone.id)
+        entry = {}
+        if zone.delayTimer is not None:
+            entry["delay"] = list(zone.delayTimer)
+        if zone.forceTimer is not None:
+            entry["force"] = zone.forceTimer
+        if zone.activity:
+            entry["activity"] = list(zone.activity)
+        if entry:
+            self.snapshotEntries[zone.id] = json.dumps(entry, separators=(",", ":"))
+        else:
+            self.snapshotEntries.pop(zone.id, None)
+
+    def save_snapshot(self):
+        # Write the deadlines and activity of every zone to the plugin's data folder.  Only the zones that changed
+        # since the last write are encoded again; a zone that has stopped keeps the entry it had when it stopped.
+        self.snapshotDue = None
+        for zoneID in list(self.snapshotDirty):
+            zone = self.zones.get(zoneID, None)
+            if zone is not None:
+                self.encode_snapshot_entry(zone)
+            else:
+                self.snapshotDirty.discard(zoneID)
+        zones = ",".join(f'"{zoneID}":{entry}' for zoneID, entry in self.snapshotEntries.items())
+        path = os.path.join(self.data_folder(), SNAPSHOT_FILE)
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(f'{{"version":1,"saved":{self.clock()},"zones":{{{zones}}}}}')
+            os.replace(path + ".tmp", path)  # never leave a half-written snapshot behind
+        except OSError as err:
+            self.logger.warning(f"Couldn't save the timer snapshot to {path}: {err}")
+            return
+        self.count(None, "snapshotsSaved")
+        self.trace(None, "save_snapshot: %d zone(s) saved to %s", len(self.snapshotEntries), path)
+
+    def load_snapshot(self):
+        # Read what the last run left behind, for each zone to pick up when it starts, see restore_zone.
+        path = os.path.join(self.data_folder(), SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            self.restored = {int(zoneID): entry for zoneID, entry in snapshot["zones"].items()}
+        except (OSError, ValueError, KeyError, AttributeError) as err:
+            self.logger.warning(f"Ignoring the timer snapshot in {path}: {err}")
+            return
+        self.snapshotEntries = {zoneID: json.dumps(entry, separators=(",", ":")) for zoneID, entry in self.restored.items()}
+        self.logger.debug(f"Loaded a timer snapshot of {len(self.restored)} zone(s) saved at {time.ctime(snapshot.get('saved', 0))}")
+
+    def restore_zone(self, zone, saved):
+        # Pick up where the zone was before the plugin stopped.  Activity that has aged out of the window is
+        # dropped.  A timer that ran out while the plugin was down fires on the first tick, so the zone ends up
+        # where it would have been, rather than starting the whole delay over - unless the evaluation that
+        # deviceStartComm runs next finds the condition has since reverted, and cancels it.
+        now = self.clock()
+        if zone.typeId == 'activityZone' and saved.get("activity"):
+            zone.activity = zone.activity_history(sorted(set(zone.activity) | set(saved["activity"])))
+            expired = zone.expire_activity(now)
+            self.trace(zone, "%s: restored %d activation(s), %d expired", zone.name, len(zone.activity), expired)
+        if zone.typeId == 'area':
+            if saved.get("delay"):
+                deadline, occupied = saved["delay"]
+                self.arm_delay_timer(zone, max(deadline, now), bool(occupied))
+            if saved.get("force") and zone.forceOff > 0.0:
+                self.arm_force_timer(zone, max(saved["force"], now))
+            self.trace(zone, "%s: restored delay timer %s, force off timer %s", zone.name, zone.delayTimer, zone.forceTimer)
+
+    ########################################
+    # Occupancy history
+    ########################################
+
+    def occupancy_history(self):
+        if self.history is None:
+            self.history = OccupancyHistory(self.data_folder("history"))
+        return self.history
+
+    def record_transition(self, zoneID, occupied):
+        history = self.occupancy_history()
+        now = self.clock()
+        try:
+            if history.needs_segment(now):
+                # a new segment starts with where every zone stands; this zone is still in its old state
+                for otherID in list(self.zones):
+                    state = not occupied if otherID == zoneID else otherID in self.shadows and self.shadows[otherID].onState
+                    history.append(now, otherID, state, HISTORY_CHECKPOINT)
+            history.append(now, zoneID, occupied)
+        except OSError as err:
+            self.warn_limited(self.zones.get(zoneID, None), "history", "Couldn't write the occupancy history: %s", err)
+
+    def parse_time(self, value, default):
+        # Epoch seconds, or a local "YYYY-MM-DD" or "YYYY-MM-DD HH:MM".
+        if value in (None, ""):
+            return default
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+        for layout in ("%Y-%m-%d", "%Y-%m-%d %H:%M"):
+            try:
+                return time.mktime(time.strptime(str(value), layout))
+            except ValueError:
+                continue
+        raise ValueError(f"'{value}' is not epoch seconds, YYYY-MM-DD or YYYY-MM-DD HH:MM")
+
+    def occupancy_summary(self, zoneIDs, start=None, end=None, byDay=False):
+        # Script API: occupancy of the given zones from start (default midnight today) to end (default now),
+        # as {zone id: totals}.  With byDay, each zone's totals also carry a "days" list of the same per day.
+        history = self.occupancy_history()
+        now = self.clock()
+        end = min(self.parse_time(end, now), now)
+        start = self.parse_time(start, history.day_start(history.day_of(now)))
+        zones = history.summarize(zoneIDs, start, end)
+        if byDay:
+            for zone in zones.values():
+                zone["days"] = []
+            day = history.day_of(start)
+            while history.day_start(day) < end:
+                nextDay = history.next_day(day)
+                dayStart, dayEnd = max(start, history.day_start(day)), min(end, history.day_start(nextDay))
+                for zoneID, totals in history.summarize(zoneIDs, dayStart, dayEnd).items():
+                    zones[zoneID]["days"].append(dict(totals, day=day))
+                day = nextDay
+        return zones
+
+    @on_worker
+    def getOccupancyHistory(self, action, device, caller_waiting_for_result=None):
+        # Hidden action for scripts: props start, end and byDay as for occupancy_summary.
+        self.logger.debug(f"getOccupancyHistory, zoneDevice={device.id}, props={action.props}")
+        reply_dict = indigo.Dict()
+        try:
+            totals = self.occupancy_summary([device.id], action.props.get("start", None), action.props.get("end", None),
+                                            str(action.props.get("byDay", "false")).lower() == "true")[device.id]
+        except ValueError as err:
+            self.logger.error(f"Couldn't complete 'getOccupancyHistory' action: {err}")
+            reply_dict["status"] = False
+            reply_dict["errors"] = {"start": str(err)}
+            return reply_dict
+        reply_dict["status"] = True
+        for key, value in totals.items():
+            reply_dict[key] = to_indigo(value)
+        return reply_dict
 
     ########################################
     # Trigger (Event) handling
     ########################################
 
+    @on_worker
     def triggerStartProcessing(self, trigger):
         self.logger.debug(f"{trigger.name}: Adding Trigger")
         assert trigger.id not in self.triggers
-        self.triggers[trigger.id] = trigger
 
+        # everything about matching a trigger is decided here, once, so a zone transition only has to look up
+        # the triggers it is going to fire.  A trigger that can never fire is reported now and not indexed.
+        if trigger.pluginTypeId == "zoneOccupied":
+            occupied = True
+        elif trigger.pluginTypeId == "zoneUnoccupied":
+            occupied = False
+        else:
+            self.logger.error(f"{trigger.name}: Unknown Trigger Type {trigger.pluginTypeId}, trigger ignored")
+            return
+        try:
+            zoneID = int(trigger.pluginProps.get("zoneDevice", ""))
+        except ValueError:
+            self.logger.error(f"{trigger.name}: No zone selected, trigger ignored")
+            return
+
+        key = (zoneID, occupied)
+        self.triggers[trigger.id] = key
+        self.triggerIndex.setdefault(key, {})[trigger.id] = trigger
+
+    @on_worker
     def triggerStopProcessing(self, trigger):
         self.logger.debug(f"{trigger.name}: Removing Trigger")
-        assert trigger.id in self.triggers
-        del self.triggers[trigger.id]
+        key = self.triggers.pop(trigger.id, None)
+        if key is None:  # rejected by triggerStartProcessing
+            return
+        indexed = self.triggerIndex.get(key, {})
+        indexed.pop(trigger.id, None)
+        if not indexed:
+            self.triggerIndex.pop(key, None)
 
     def check_triggers(self, device, occupied):
-
-        for trigger in self.triggers.values():
-            self.logger.debug(f"{trigger.name}: Testing Event Trigger")
-
-            if trigger.pluginProps["zoneDevice"] == str(device.id):
-                self.logger.debug(f"{trigger.name}: Match on Zone {device.name}")
-
-                if trigger.pluginTypeId == "zoneOccupied":
-                    if occupied:
-                        indigo.trigger.execute(trigger)
-                elif trigger.pluginTypeId == "zoneUnoccupied":
-                    if not occupied:
-                        indigo.trigger.execute(trigger)
-                else:
-                    self.logger.error(f"{trigger.name}: Unknown Trigger Type {trigger.pluginTypeId}")
+        # Called on every transition, so this is also where a transition gets timed against the sensor event
+        # that led to it.
+        zone = self.zones.get(device.id, None)
+        self.record_transition(device.id, occupied)
+        if zone is not None:
+            self.count(zone, "transitions")
+            if zone.eventTime is not None:
+                self.histograms["eventToTransition"].add(self.clock() - zone.eventTime)
+                zone.eventTime = None
+        for trigger in list(self.triggerIndex.get((device.id, occupied), {}).values()):
+            self.trace(zone, "%s: Match on Zone %s", trigger.name, device.name)
+            self.count(zone, "triggersExecuted")
+            indigo.trigger.execute(trigger)
 
     ########################################
     # Action methods
@@ -407,6 +1871,9 @@ class Plugin(indigo.PluginBase):
 
     def getActionConfigUiValues(self, action_props, type_id, dev_id):
         self.logger.debug(f"getActionConfigUiValues, actionProps = {action_props}, type_id = {type_id}, dev_id = {dev_id}")
+        if type_id in BULK_ACTIONS:  # not tied to a device, so nothing to prefill from
+            action_props.setdefault("selectBy", "zones")
+            return action_props
         device = indigo.devices[dev_id]
         if type_id == "cancelTimer":
             pass
@@ -426,10 +1893,13 @@ class Plugin(indigo.PluginBase):
                 action_props["forceOffValue"] = device.pluginProps['forceOffValue']
         return action_props
 
+    @on_worker  # the bulk actions' selection reads the running zones, see select_zones
     def validateActionConfigUi(self, values_dict, type_id, dev_id):
         self.logger.debug(f"validateActionConfigUi, values_dict = {values_dict}, type_id = {type_id}, dev_id = {dev_id}")
-        device = indigo.devices[dev_id]
-        if type_id == "cancelTimer":
+        if type_id in BULK_ACTIONS:
+            is_valid, errors = self.validate_bulk_action(type_id, values_dict)
+            return is_valid, values_dict, errors
+        elif type_id == "cancelTimer":
             is_valid, errors = self.validate_cancel_timer_action(dev_id, values_dict)
             return is_valid, values_dict, errors
         elif type_id == "updateActivityZone":
@@ -443,7 +1913,7 @@ class Plugin(indigo.PluginBase):
 
     def validate_cancel_timer_action(self, dev_id, props):
         errors = indigo.Dict()
-        if dev_id not in indigo.devices:
+        if dev_id is not None and dev_id not in indigo.devices:
             errors["device"] = "'deviceId' must be included and must represent an existing device"
 
         if "state" not in props:
@@ -456,7 +1926,7 @@ class Plugin(indigo.PluginBase):
 
     def validate_force_zone_off_action(self, dev_id):
         errors = indigo.Dict()
-        if dev_id not in indigo.devices:
+        if dev_id is not None and dev_id not in indigo.devices:
             errors["device"] = "'deviceId' must be included and must represent an existing device"
 
         self.logger.debug(f"validate_force_zone_off_action, errors={errors}")
@@ -464,7 +1934,7 @@ class Plugin(indigo.PluginBase):
 
     def validate_update_activity_zone_action(self, dev_id, props):
         errors = indigo.Dict()
-        if dev_id not in indigo.devices:
+        if dev_id is not None and dev_id not in indigo.devices:
             errors["device"] = "'deviceId' must be included and must represent an existing device"
 
         try:
@@ -484,7 +1954,7 @@ class Plugin(indigo.PluginBase):
 
     def validate_update_occupancy_zone_action(self, dev_id, props):
         errors = indigo.Dict()
-        if dev_id not in indigo.devices:
+        if dev_id is not None and dev_id not in indigo.devices:  # None for a bulk action, see validate_bulk_action
             errors["device"] = "'deviceId' must be included and must represent an existing device"
 
         try:
@@ -509,28 +1979,141 @@ class Plugin(indigo.PluginBase):
         self.logger.debug(f"validate_update_occupancy_zone_action, errors={errors}")
         return (not bool(errors)), errors  # bool(errors) will return False if empty, True if not)
 
+    def validate_bulk_action(self, type_id, props):
+        # The parameters are checked once for every zone the action names, then the selection itself.
+        if type_id == "bulkCancelTimer":
+            _, errors = self.validate_cancel_timer_action(None, props)
+        elif type_id == "bulkUpdateActivityZones":
+            _, errors = self.validate_update_activity_zone_action(None, props)
+        elif type_id == "bulkUpdateOccupancyZones":
+            _, errors = self.validate_update_occupancy_zone_action(None, props)
+        else:
+            errors = indigo.Dict()
+        _, selectErrors = self.select_zones(props, BULK_ACTIONS[type_id])
+        errors.update(selectErrors)
+        self.logger.debug(f"validate_bulk_action, errors={errors}")
+        return (not bool(errors)), errors
+
+    def select_zones(self, props, typeId):
+        # The zone ids a bulk action names: a list of zones, every zone of the action's type in a folder, or every
+        # one whose Notes carry a tag (Indigo devices have no tags of their own, so a word in the Notes stands in,
+        # with or without a leading #).  Scripts can leave out selectBy and give just one of the three.  Reads
+        # the running zones, so only for the worker.
+        errors = indigo.Dict()
+        zoneIDs = props.get("zones", None) or []
+        if isinstance(zoneIDs, str):
+            zoneIDs = [zoneID for zoneID in zoneIDs.split(",") if zoneID.strip()]
+        folder = str(props.get("zoneFolder", "") or "").strip()
+        tag = str(props.get("zoneTag", "") or "").strip().lstrip("#").lower()
+        selectBy = props.get("selectBy", None)
+        if selectBy is None:
+            given = [key for key, value in (("zones", zoneIDs), ("folder", folder), ("tag", tag)) if value]
+            if len(given) != 1:
+                errors["selectBy"] = "exactly one of 'zones', 'zoneFolder' or 'zoneTag' is required"
+                return [], errors
+            selectBy = given[0]
+
+        if selectBy == "zones":
+            selected = []
+            for zoneID in zoneIDs:
+                try:
+                    selected.append(int(zoneID))
+                except (TypeError, ValueError):
+                    errors["zones"] = f"{zoneID} is not a device id"
+            if not zoneIDs:
+                errors["zones"] = "no zones selected"
+            return selected, errors
+        if selectBy == "folder":
+            try:
+                folderID = int(folder)
+            except ValueError:
+                errors["zoneFolder"] = f"{folder} is not a folder id"
+                return [], errors
+            match = lambda device: device.folderId == folderID  # noqa: E731
+        elif selectBy == "tag":
+            if not tag:
+                errors["zoneTag"] = "'zoneTag' is missing"
+                return [], errors
+            match = lambda device: tag in (word.lstrip("#") for word in device.description.lower().split())  # noqa: E731
+        else:
+            errors["selectBy"] = f"{selectBy} must be one of: 'zones', 'folder', 'tag'"
+            return [], errors
+        return [zoneID for zoneID, zone in sorted(self.zones.items())
+                if zone.typeId == typeId and zoneID in indigo.devices and match(indigo.devices[zoneID])], errors
+
+    def bulk_action(self, type_id, action, apply):
+        # Validate once, then run apply(zone, zoneDevice) over every selected zone in one pass.  The reply_dict has
+        # the overall status and, under "zones", each zone's name, status and error keyed by its id.
+        self.logger.debug(f"{type_id}, pluginAction={action}")
+        reply_dict = indigo.Dict()
+        is_valid, errors = self.validate_bulk_action(type_id, action.props)
+        reply_dict["status"] = is_valid
+        if not is_valid:
+            self.logger.error(f"Couldn't complete '{type_id}' action because of errors:\n{dict(errors)}")
+            reply_dict["errors"] = errors
+            return reply_dict
+
+        typeId = BULK_ACTIONS[type_id]
+        results = indigo.Dict()
+        for zoneID in self.select_zones(action.props, typeId)[0]:
+            zone = self.zones.get(zoneID, None)
+            result = indigo.Dict()
+            if zoneID not in indigo.devices:
+                error = "device not found"
+            else:
+                zoneDevice = indigo.devices[zoneID]
+                result["name"] = zoneDevice.name
+                if zone is None:
+                    error = "zone is not running"
+                elif zone.typeId != typeId:
+                    error = f"not a {typeId} zone"
+                else:
+                    error = apply(zone, zoneDevice)
+            result["status"] = error is None
+            if error is not None:
+                result["error"] = error
+                reply_dict["status"] = False
+            results[str(zoneID)] = result
+        reply_dict["zones"] = results
+        if not reply_dict["status"]:
+            failed = {zoneID: result["error"] for zoneID, result in results.items() if "error" in result}
+            self.logger.warning(f"{type_id}: {len(failed)} of {len(results)} zone(s) not updated: {failed}")
+        return reply_dict
+
+    @on_worker
     def cancelTimer(self, action, device, caller_waiting_for_result=None):
         self.logger.debug(f"cancelTimer, zoneDevice={device.id}, pluginAction={action}")
         reply_dict = indigo.Dict()  # This will hold the status and errors or device details in the appropriate format
         is_valid, errors = self.validate_cancel_timer_action(device.id, action.props)
         reply_dict["status"] = is_valid
+        zone = self.zones.get(device.id, None)
         if not is_valid:
             self.logger.error(f"Couldn't complete 'cancelTimer' action because of errors:\n{dict(errors)}")
             reply_dict["errors"] = errors
-        elif self.delayTimers.pop(device.id, None) is None:  # pop, the timer thread can complete it underneath us
+        elif zone is None or not self.cancel_zone_timer(zone, device, action.props["state"]):
             self.logger.warning(f"{device.name}: cancelTimer, no timer found")
             reply_dict["errors"] = {"forceOffValue": f"cancelTimer, no timer found for device {device.id}"}
-        else:
-            device.updateStateOnServer(key='delay_timer', value=0.0)
-            state = action.props["state"]
-            if state == "on":
-                device.updateStateOnServer(key='onOffState', value=True, uiValue="On")
-                device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensorTripped)
-            elif state == "off":
-                device.updateStateOnServer(key='onOffState', value=False, uiValue="Off")
-                device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
         return reply_dict
 
+    def cancel_zone_timer(self, zone, device, state):
+        # Returns False if there was no delay timer to cancel.
+        if self.end_delay_timer(zone) is None:  # the timer thread can complete it underneath us
+            return False
+        self.wakeup.set()  # stop refreshing the countdown
+        self.clear_countdown(zone, device, 'delay_timer')
+        if state != "unchanged" and (state == "on") != bool(device.onState):
+            self.record_transition(device.id, state == "on")
+        if state == "on":
+            self.update_state(zone, device, key='onOffState', value=True, uiValue="On")
+            device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensorTripped)
+        elif state == "off":
+            self.update_state(zone, device, key='onOffState', value=False, uiValue="Off")
+            device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
+        if state != "unchanged":
+            self.propagate_transition(device.id, state == "on")
+        return True
+
+    @on_worker
     def forceZoneOff(self, action, device, caller_waiting_for_result=None):
         self.logger.debug(f"forceZoneOff, zoneDevice={device.id}")
         reply_dict = indigo.Dict()  # This will hold the status and errors or device details in the appropriate format
@@ -540,13 +2123,23 @@ class Plugin(indigo.PluginBase):
             self.logger.error(f"Couldn't complete 'forceZoneOff' action because of errors:\n{dict(errors)}")
             reply_dict["errors"] = errors
         else:
-            device.updateStateOnServer(key='onOffState', value=False, uiValue="Off")
-            device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
+            self.force_zone_off(self.zones.get(device.id, None), device)
         return reply_dict
 
+    def force_zone_off(self, zone, device):
+        if device.onState:
+            self.record_transition(device.id, False)
+        self.update_state(zone, device, key='onOffState', value=False, uiValue="Off")
+        device.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
+        self.propagate_transition(device.id, False)
+
     def updateActivityZone(self, plugin_action, zone_device, caller_waiting_for_result=None):
+        return self.persist_props(self.update_activity_zone, plugin_action, zone_device)
+
+    def update_activity_zone(self, plugin_action, zone_device):
         self.logger.debug(f"updateActivityZone, zoneDevice={zone_device.id}, pluginAction={plugin_action}")
         reply_dict = indigo.Dict()  # This will hold the status and errors or device details in the appropriate format
+        writes = []
         is_valid, errors = self.validate_update_activity_zone_action(zone_device.id, plugin_action.props)
         reply_dict["status"] = is_valid
         if not is_valid:
@@ -556,15 +2149,16 @@ class Plugin(indigo.PluginBase):
             self.logger.warning(f"{zone_device.name}: updateActivityZone, device not found")
             reply_dict["errors"] = {"forceOffValue": f"updateActivityZone, device not found: {zone_device.id}"}
         else:
-            props = zone_device.pluginProps
-            props["activityCount"] = plugin_action.props["activityCount"]
-            props["activityWindow"] = plugin_action.props["activityWindow"]
-            zone_device.replacePluginPropsOnServer(props)
-        return reply_dict
+            writes.append((zone_device, self.update_zone_props(zone_device, self.activity_zone_props(plugin_action.props))))
+        return reply_dict, writes
 
     def updateOccupancyZone(self, plugin_action, zone_device, caller_waiting_for_result=None):
+        return self.persist_props(self.update_occupancy_zone, plugin_action, zone_device)
+
+    def update_occupancy_zone(self, plugin_action, zone_device):
         self.logger.debug(f"updateOccupancyZone, zoneDevice={zone_device.id}, pluginAction={plugin_action}")
         reply_dict = indigo.Dict()  # This will hold the status and errors or device details in the appropriate format
+        writes = []
         is_valid, errors = self.validate_update_occupancy_zone_action(zone_device.id, plugin_action.props)
         reply_dict["status"] = is_valid
         if not is_valid:
@@ -574,27 +2168,174 @@ class Plugin(indigo.PluginBase):
             self.logger.warning(f"{zone_device.name}: updateOccupancyZone, device not found")
             reply_dict["errors"] = {"forceOffValue": f"updateOccupancyZone, device not found: {zone_device.id}"}
         else:
-            props = zone_device.pluginProps
-            props["onDelayValue"] = str(plugin_action.props["onDelayValue"])
-            props["offDelayValue"] = str(plugin_action.props["offDelayValue"])
-            props["forceOffValue"] = str(plugin_action.props["forceOffValue"])
-            zone_device.replacePluginPropsOnServer(props)
+            writes.append((zone_device, self.update_zone_props(zone_device, self.occupancy_zone_props(plugin_action.props))))
+        return reply_dict, writes
+
+    @staticmethod
+    def activity_zone_props(action_props):
+        return {"activityCount": action_props["activityCount"], "activityWindow": action_props["activityWindow"]}
+
+    @staticmethod
+    def occupancy_zone_props(action_props):
+        return {key: str(action_props[key]) for key in ("onDelayValue", "offDelayValue", "forceOffValue")}
+
+    def update_zone_props(self, zoneDevice, updates):
+        # Apply the new timing to the running zone and return the props to persist, see persist_props.
+        props = zoneDevice.pluginProps
+        props.update(updates)
+        zone = self.zones.get(zoneDevice.id, None)
+        if zone is not None:
+            self.apply_props(zone, zoneDevice, props)
+        return props
+
+    def persist_props(self, function, *args):
+        # For whatever edits zones' props: function runs on the worker, applies the edits to the running zones
+        # and returns (reply_dict, [(zone device, props)]); the props are then written from this thread.  The
+        # write is a server call that can come back as a deviceStopComm/deviceStartComm, which Indigo delivers
+        # on its own thread - the one that would otherwise be sitting in call, waiting on the worker making it.
+        # The edits are in force before anything is written.  For the update actions the members haven't
+        # changed, so Indigo reports the write through deviceUpdated rather than restarting the device.
+        result = self.call(function, *args)
+        if result is None:  # the worker didn't answer, see call
+            return None
+        reply_dict, writes = result
+        for zoneDevice, props in writes:
+            zoneDevice.replacePluginPropsOnServer(props)
         return reply_dict
 
+    def update_zones(self, type_id, action, props):
+        # The worker's half of a bulk update: props(action props) for each selected zone, see persist_props.
+        writes = []
+
+        def apply(zone, zoneDevice):
+            writes.append((zoneDevice, self.update_zone_props(zoneDevice, props(action.props))))
+
+        return self.bulk_action(type_id, action, apply), writes
+
+    @on_worker
+    def bulkCancelTimer(self, action, device=None, caller_waiting_for_result=None):
+        return self.bulk_action("bulkCancelTimer", action, lambda zone, zoneDevice:
+                                None if self.cancel_zone_timer(zone, zoneDevice, action.props["state"]) else "no timer found")
+
+    @on_worker
+    def bulkForceZonesOff(self, action, device=None, caller_waiting_for_result=None):
+        return self.bulk_action("bulkForceZonesOff", action, self.force_zone_off)
+
+    def bulkUpdateActivityZones(self, action, device=None, caller_waiting_for_result=None):
+        return self.persist_props(self.update_zones, "bulkUpdateActivityZones", action, self.activity_zone_props)
+
+    def bulkUpdateOccupancyZones(self, action, device=None, caller_waiting_for_result=None):
+        return self.persist_props(self.update_zones, "bulkUpdateOccupancyZones", action, self.occupancy_zone_props)
+
+    @on_worker
+    def getPerformanceStats(self, action, device=None, caller_waiting_for_result=None):
+        # Hidden action for scripts: the same numbers the menu prints, as a reply_dict.
+        return to_indigo(self.performance_stats())
+
+    ########################################
+    # Performance stats
+    ########################################
+
+    def performance_stats(self):
+        # Everything counted since the last reset, as plain dicts and lists.  Zones are a list rather than keyed by
+        # name or id, neither of which makes a valid indigo.Dict key.
+        zones = []
+        for zoneID, stats in sorted(self.zoneStats.items()):
+            zone = self.zones.get(zoneID, None)
+            name = zone.name if zone else indigo.devices[zoneID].name if zoneID in indigo.devices else str(zoneID)
+            zones.append(dict(nest_counters(stats), id=zoneID, name=name))
+        return {"since": self.statsSince, "seconds": round(time.time() - self.statsSince, 3),
+                "counters": nest_counters(self.counters),
+                "latency": {name: histogram.summary() for name, histogram in self.histograms.items()},
+                "zones": zones}
+
+    @on_worker
+    def printPerformanceStats(self):
+        stats = self.performance_stats()
+        self.logger.info(f"Performance stats for the last {stats['seconds']:.0f}s:")
+        self.logger.info(f"    plugin: {self.format_counters(stats['counters'])}")
+        for name, summary in stats["latency"].items():
+            self.logger.info(f"    {name}: {summary['count']} sample(s), mean {summary['meanMs']}ms, p50 <= {summary['p50Ms']}ms, "
+                             f"p90 <= {summary['p90Ms']}ms, p99 <= {summary['p99Ms']}ms, max {summary['maxMs']}ms")
+        for zone in stats["zones"]:
+            counters = {key: value for key, value in zone.items() if key not in ("id", "name")}
+            self.logger.info(f"    {zone['name']}: {self.format_counters(counters)}")
+
+    @staticmethod
+    def format_counters(counters):
+        parts = []
+        for name, value in counters.items():
+            if isinstance(value, dict):
+                value = ", ".join(f"{key} {count}" for key, count in value.items())
+                parts.append(f"{name} ({value})")
+            else:
+                parts.append(f"{name} {value}")
+        return "; ".join(parts) or "nothing counted"
+
+    @on_worker
+    def resetPerformanceStats(self):
+        # Cleared in place: each running Zone holds a reference to its own Counter.
+        self.counters.clear()
+        for stats in self.zoneStats.values():
+            stats.clear()
+        self.histograms = {name: Histogram() for name in HISTOGRAMS}
+        self.statsSince = time.time()
+        self.logger.info("Performance stats reset")
+
+    ########################################
+    # Sensor traces
+    ########################################
+
+    @on_worker
+    def startTraceRecording(self):
+        # Record every sensor transition the zones see, for tests/replay.py to play back offline.  The header
+        # is a snapshot of the zones, their sensors and the triggers on them, so the trace replays on its own.
+        if self.traceFile is not None:
+            self.logger.warning(f"Already recording a sensor trace to {self.traceFile.name}")
+            return
+        path = os.path.join(self.data_folder("traces"), time.strftime("trace-%Y%m%d-%H%M%S.txt"))
+        self.traceStart = self.clock()
+        header = {"started": self.traceStart,
+                  "zones": [{"id": device.id, "name": device.name, "typeId": device.deviceTypeId,
+                             "onState": bool(device.onState), "props": dict(device.pluginProps)}
+                            for device in indigo.devices.iter("self")],
+                  "sensors": [{"id": sensorID, "name": indigo.devices[sensorID].name,
+                               "onState": bool(indigo.devices[sensorID].onState)}
+                              for sensorID in sorted(self.watchList) if sensorID in indigo.devices],
+                  "triggers": [{"id": trigger.id, "name": trigger.name, "pluginTypeId": trigger.pluginTypeId,
+                                "zoneDevice": zoneID}
+                               for (zoneID, _), indexed in self.triggerIndex.items() for trigger in indexed.values()]}
+        self.traceFile = open(path, "w")
+        self.traceFile.write(TRACE_HEADER + "\n" + json.dumps(header) + "\n")
+        self.logger.info(f"Recording sensor trace to {path}")
+
+    @on_worker
+    def stopTraceRecording(self):
+        traceFile, self.traceFile = self.traceFile, None
+        if traceFile is None:
+            return
+        traceFile.close()
+        self.logger.info(f"Sensor trace saved to {traceFile.name}")
+
     ########################################
     # ConfigUI methods
     ########################################
 
+    @on_worker
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         if not userCancelled:
             self.logLevel = int(valuesDict.get("logLevel", logging.INFO))
             self.indigo_log_handler.setLevel(self.logLevel)
             self.logger.debug(f"logLevel = {self.logLevel}")
+            self.debugAll = self.debug_logged()
+            self.countdownRefresh = self.valid_countdown_mode(valuesDict.get("countdownRefresh", "1"), "1")
+            self.wakeup.set()  # running countdowns pick up the new cadence
 
     ########################################
     # This routine will validate the device configuration dialog when the user attempts to save the data
     ########################################
 
+    @on_worker
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
         self.logger.debug(f"validateDeviceConfigUi, devId={devId}, typeId={typeId}, valuesDict = {valuesDict}")
         errorMsgDict = indigo.Dict()
@@ -610,6 +2351,11 @@ class Plugin(indigo.PluginBase):
             errorMsgDict["sensorDevices"] = "Sensor Recursion Detected"
             return False, valuesDict, errorMsgDict
 
+        if not str(valuesDict.get("coalesceWindow", "0")).isdigit():
+            self.logger.error("Configuration Error: A number for time in milliseconds is required")
+            errorMsgDict["coalesceWindow"] = "Please enter a valid number"
+            return False, valuesDict, errorMsgDict
+
         if typeId == 'area':
 
             if valuesDict.get("onSensorsOnOff", None) == "change":
@@ -628,6 +2374,25 @@ class Plugin(indigo.PluginBase):
                 errorMsgDict["offDelayValue"] = "Please enter a valid number"
                 return False, valuesDict, errorMsgDict
 
+        elif typeId == 'scoreZone':
+
+            scores = {}
+            for key in ("onScore", "offScore"):
+                try:
+                    scores[key] = float(valuesDict.get(key, ""))
+                except ValueError:
+                    self.logger.error("Configuration Error: A number for the score is required")
+                    errorMsgDict[key] = "Please enter a valid number"
+                    return False, valuesDict, errorMsgDict
+            if scores["onScore"] <= 0.0:
+                self.logger.error("Configuration Error: The occupied score must be above 0")
+                errorMsgDict["onScore"] = "Please enter a number above 0"
+                return False, valuesDict, errorMsgDict
+            if not 0.0 <= scores["offScore"] <= scores["onScore"]:
+                self.logger.error("Configuration Error: The unoccupied score must be between 0 and the occupied score")
+                errorMsgDict["offScore"] = "Please enter a number from 0 up to the occupied score"
+                return False, valuesDict, errorMsgDict
+
         elif typeId == 'activityZone':
 
             if not str(valuesDict.get("activityWindow", "")).isdigit():
@@ -640,23 +2405,38 @@ class Plugin(indigo.PluginBase):
                 errorMsgDict["activityCount"] = "Please enter a valid number"
                 return False, valuesDict, errorMsgDict
 
+            if not str(valuesDict.get("statsRefresh", "60")).isdigit():
+                self.logger.error("Configuration Error: A number for time in seconds is required")
+                errorMsgDict["statsRefresh"] = "Please enter a valid number"
+                return False, valuesDict, errorMsgDict
+
         return True, valuesDict
 
     def is_recursive(self, devId, devName, sensorDevices):
+        # Would giving devId these sensors make it contain itself, at any depth?  Only the new sensor list needs
+        # checking - the rest of the graph had no loop before this edit - so this walks down from it looking for
+        # devId, visiting each zone once.  Running zones are read from the watch index; a stopped one falls
+        # back to its props.
         self.logger.debug(f"is_recursive, devId = {devId}, devName = {devName}, sensorDevices = {sensorDevices}")
 
-        sensorList = sensorDevices.split(",")
-        if str(devId) in sensorList:
-            self.logger.error(f"{devName}: Recursion Error - Sensor {devId} found in sensor list: {sensorDevices}")
-            return True
-
-        for sensorID in sensorList:
+        pending = [x.strip() for x in sensorDevices.split(",")]
+        seen = set()
+        while pending:
+            sensorID = pending.pop()
             try:
-                sensorDev = indigo.devices[int(sensorID)]
-            except (Exception,):
+                sensorID = int(sensorID)
+            except ValueError:
+                continue
+            if sensorID == devId:
+                self.logger.error(f"{devName}: Recursion Error - zone {devId} would contain itself through sensor list: {sensorDevices}")
+                return True
+            if sensorID in seen:
                 continue
-            if sensorDev.pluginId == self.pluginId and sensorDev.deviceTypeId == 'area':
-                return self.is_recursive(devId, sensorDev.name, sensorDev.pluginProps.get('sensorDevices', None))
+            seen.add(sensorID)
+            if sensorID in self.zoneWatches:
+                pending.extend(self.zoneWatches[sensorID])
+            elif sensorID in indigo.devices and indigo.devices[sensorID].pluginId == self.pluginId:
+                pending.extend(self.sensor_ids_for_zone(indigo.devices[sensorID]))
 
         return False
 
@@ -666,21 +2446,44 @@ class Plugin(indigo.PluginBase):
     #
     ################################################################################
 
+    def is_candidate(self, device):
+        return isinstance(device, indigo.SensorDevice) and device.supportsOnState
+
+    def index_candidate(self, device):
+        # Add, rename or drop one device in the candidate index.  Nothing to do until a dialog has built it.
+        if self.candidates is None:
+            return
+        if self.is_candidate(device):
+            if self.candidates.get(device.id, None) != device.name:
+                self.candidates[device.id] = device.name
+                self.candidateList = None
+        elif self.candidates.pop(device.id, None) is not None:
+            self.candidateList = None
+
+    def candidate_sensors(self):
+        # Every device a zone can use as a sensor, sorted by name.  The device database is scanned once, the
+        # first time a dialog asks; after that deviceCreated, deviceDeleted and deviceUpdated keep it current.
+        if self.candidates is None:
+            self.candidates = {device.id: device.name for device in indigo.devices.iter("indigo.sensor")
+                               if device.supportsOnState}
+        if self.candidateList is None:
+            self.candidateList = sorted(((str(sensorID), name) for sensorID, name in self.candidates.items()),
+                                        key=lambda item: item[1].lower())
+        return self.candidateList
+
     ########################################
     # This is the method that's called to build the source device list. 
     ########################################
     def sensorDevices(self, filter="", valuesDict=None, typeId="", targetId=0):
         self.logger.threaddebug(f"sensorDevices, targetId={targetId}, typeId={typeId}, filter={filter}, valuesDict = {valuesDict}")
-        returnList = list()
 
         if not valuesDict:
             valuesDict = {}
 
-        deviceList = valuesDict.get("sensorDevices", "").split(",")
-        for device in indigo.devices.iter("indigo.sensor"):
-            if (str(device.id) not in deviceList) and device.supportsOnState:
-                returnList.append((str(device.id), device.name))
-        return returnList
+        # the zone itself is left out too, it can never be its own sensor
+        excluded = set(valuesDict.get("sensorDevices", "").split(","))
+        excluded.add(str(targetId))
+        return [item for item in self.candidate_sensors() if item[0] not in excluded]
 
     ########################################
     # This is the method that's called by the Add Device button in the config dialog.
@@ -702,6 +2505,11 @@ class Plugin(indigo.PluginBase):
                 selectedDevicesString += "," + str(deviceId)
 
             valuesDict["sensorDevices"] = selectedDevicesString
+            if typeId == 'scoreZone':  # the weight fields go with the device being added
+                weights = parse_weights(valuesDict.get("sensorWeights", ""))
+                weights[int(deviceId)] = (parse_seconds(valuesDict.get("sensorWeight", "1"), 1.0),
+                                          parse_seconds(valuesDict.get("sensorHalfLife", "0")))
+                valuesDict["sensorWeights"] = format_weights(weights)
             self.logger.debug(f"valuesDict = {valuesDict}")
 
             if "sensorDeviceList" in valuesDict:
@@ -726,6 +2534,10 @@ class Plugin(indigo.PluginBase):
                 if deviceId in devicesInZone:
                     devicesInZone.remove(deviceId)
             valuesDict["sensorDevices"] = ",".join(devicesInZone)
+            if typeId == 'scoreZone':
+                weights = parse_weights(valuesDict.get("sensorWeights", ""))
+                valuesDict["sensorWeights"] = format_weights({memberID: weight for memberID, weight in weights.items()
+                                                              if str(memberID) in devicesInZone})
 
             if "sensorDeviceList" in valuesDict:
                 del valuesDict["sensorDeviceList"]
@@ -746,10 +2558,19 @@ class Plugin(indigo.PluginBase):
             self.logger.debug(f"deviceListString: {deviceListString}")
             deviceList = deviceListString.split(",")
 
+            self.candidate_sensors()  # make sure the index is built
+            weights = parse_weights(valuesDict.get("sensorWeights", "")) if typeId == 'scoreZone' else None
             for devId in deviceList:
                 try:
-                    if int(devId) in indigo.devices:
-                        returnList.append((devId, indigo.devices[int(devId)].name))
-                except (Exception,):
+                    sensorID = int(devId)
+                except ValueError:
                     continue
+                name = self.candidates.get(sensorID, None)
+                if name is None and sensorID in indigo.devices:  # a member that isn't a candidate, e.g. added by a script
+                    name = indigo.devices[sensorID].name
+                if name is not None and weights is not None:
+                    weight, halfLife = weights.get(sensorID, (1.0, 0.0))
+                    name += f" (weight {weight:g}, half-life {halfLife:g}s)" if halfLife else f" (weight {weight:g})"
+                if name is not None:
+                    returnList.append((devId, name))
         return returnList
@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic-home benchmarks for Occupatum, run against the stub indigo module in this directory.
+
+    python3 tests/benchmark.py                              # 10, 100, 1000 and 5000 zones
+    python3 tests/benchmark.py --zones 50,500 --fanout 4 --output after.json
+    python3 tests/benchmark.py --output after.json --baseline before.json
+    python3 tests/benchmark.py --plugin old/plugin.py --output before.json
+
+Each case builds a home of area zones over a shared pool of motion sensors, starts every zone the way Indigo
+would, then drives a seeded stream of sensor on/off events through deviceUpdated and times timer-thread ticks
+with the resulting delay and force-off timers pending.  One JSON object per case goes to --output (or stdout);
+the table on stderr is for people.  --baseline compares against an earlier output file, case by case.
+
+What this measures is the plugin's own Python - the stub answers every server call instantly, so a live server
+adds its round trips on top.  Compare numbers from the same machine only.
+
+--plugin times another copy of plugin.py, e.g. one checked out from before the timer heap and the performance
+counters existed, so there is a "before" to compare against.  Everything is measured from outside the plugin -
+state writes at the stub, ticks as one pass of runConcurrentThread - so old and new are timed the same way; the
+figures only a newer plugin can report (evaluationsPerEvent) come out as null for an older one.
+"""
+
+import argparse
+import copy
+import importlib.util
+import json
+import logging
+import pathlib
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+HERE = pathlib.Path(__file__).resolve().parent
+PLUGIN = HERE.parent / "Occupatum.indigoPlugin" / "Contents" / "Server Plugin" / "plugin.py"
+
+sys.path.insert(0, str(HERE))  # so `import indigo` finds the stub
+import indigo  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+mod = None  # the plugin module under test, see load_plugin
+
+PLUGIN_ID = "com.flyingdiver.indigoplugin.occupatum"
+SENSOR_BASE = 1000000  # sensor ids start here, zone ids at 1
+OFF_DELAYS = ("0", "5", "60", "300")  # spread across zones, so some timers are always pending
+LOWER_IS_BETTER = ("usPerEvent", "tickMeanMs", "tickMaxMs", "writesPerEvent", "startupMs", "peakMemoryKB")
+
+
+def load_plugin(path):
+    global mod
+    spec = importlib.util.spec_from_file_location("occ_plugin", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+
+
+def state_writes():
+    return sum(len(device.state_writes) for device in indigo.devices.iter("self"))
+
+
+def timers_pending(plugin):
+    # zones with a delay or force-off timer running, whichever way this plugin keeps them
+    if hasattr(plugin, "counting"):
+        return len(plugin.counting)
+    return len(set(getattr(plugin, "delayTimers", {})) | set(getattr(plugin, "forceTimers", {})))
+
+
+def build_home(zones, sensors_per_zone, fanout, triggers, seed):
+    """A started plugin with `zones` area zones.  Each zone watches sensors_per_zone sensors out of a pool sized
+    so that every sensor is watched by about `fanout` zones, and has `triggers` triggers on each transition."""
+    rng = random.Random(seed)
+    indigo.devices = indigo._Devices()
+    mod.indigo.devices = indigo.devices
+    indigo.trigger.executed = []
+    indigo.server.installFolder = None  # no snapshot from an earlier run
+
+    pool = max(sensors_per_zone, zones * sensors_per_zone // max(1, fanout))
+    sensorIDs = [SENSOR_BASE + n for n in range(pool)]
+    for sensorID in sensorIDs:
+        indigo.devices.add(indigo.Device(sensorID, f"Motion {sensorID}", "sensor", pluginId="other"))
+    for zoneID in range(1, zones + 1):
+        first = (zoneID - 1) * sensors_per_zone
+        members = ",".join(str(sensorIDs[(first + n) % pool]) for n in range(sensors_per_zone))
+        props = {"sensorDevices": members, "onAnyAll": rng.choice(("any", "all")), "onSensorsOnOff": "on",
+                 "onDelayValue": "0", "offDelayValue": rng.choice(OFF_DELAYS), "forceOffValue": "3600"}
+        indigo.devices.add(indigo.Device(zoneID, f"Zone {zoneID}", "area", props=props))
+
+    plugin = mod.Plugin(PLUGIN_ID, "Occupatum", "0", {"logLevel": 50})
+    indigo.devices.plugin = plugin
+    started = time.perf_counter()
+    plugin.startup()
+    for device in list(indigo.devices.iter("self")):
+        plugin.deviceStartComm(device)
+    startup = time.perf_counter() - started
+
+    trigger_id = 0
+    for zoneID in range(1, zones + 1):
+        for typeId in ("zoneOccupied", "zoneUnoccupied"):
+            for _ in range(triggers):
+                trigger_id += 1
+                plugin.triggerStartProcessing(type("Trigger", (), {
+                    "id": trigger_id, "name": f"Trigger {trigger_id}", "pluginTypeId": typeId,
+                    "pluginProps": {"zoneDevice": str(zoneID)}})())
+    return plugin, sensorIDs, startup
+
+
+def drive_events(plugin, sensorIDs, events, seed):
+    """Toggle randomly chosen sensors `events` times, returning the seconds spent inside deviceUpdated."""
+    rng = random.Random(seed + 1)
+    spent = 0.0
+    for _ in range(events):
+        sensor = indigo.devices[rng.choice(sensorIDs)]
+        old = copy.copy(sensor)
+        sensor.onState = not sensor.onState
+        started = time.perf_counter()
+        plugin.deviceUpdated(old, sensor)
+        spent += time.perf_counter() - started
+    return spent
+
+
+def time_ticks(plugin, ticks):
+    # one pass of the timer thread each: the stub's sleep stops runConcurrentThread at the end of its first pass
+    durations = []
+    for _ in range(ticks):
+        started = time.perf_counter()
+        plugin.runConcurrentThread()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def run_case(zones, sensors_per_zone, fanout, triggers, events, ticks, seed):
+    plugin, sensorIDs, startup = build_home(zones, sensors_per_zone, fanout, triggers, seed)
+    counters = getattr(plugin, "counters", None)
+    writes, evaluations = state_writes(), counters["evaluations"] if counters is not None else None
+    spent = drive_events(plugin, sensorIDs, events, seed)
+    writes = state_writes() - writes
+    if evaluations is not None:
+        evaluations = counters["evaluations"] - evaluations
+    pending = timers_pending(plugin)
+    durations = time_ticks(plugin, ticks)
+
+    # a second, identical build under tracemalloc, which would otherwise distort the timings above
+    tracemalloc.start()
+    plugin, sensorIDs, _ = build_home(zones, sensors_per_zone, fanout, triggers, seed)
+    drive_events(plugin, sensorIDs, events, seed)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"zones": zones, "sensorsPerZone": sensors_per_zone, "fanout": fanout, "triggers": triggers,
+            "sensors": len(sensorIDs), "events": events, "ticks": ticks, "seed": seed,
+            "startupMs": round(startup * 1000.0, 3),
+            "eventsPerSec": round(events / spent, 1) if spent else None,
+            "usPerEvent": round(spent / events * 1e6, 3) if events else None,
+            "evaluationsPerEvent": round(evaluations / events, 3) if events and evaluations is not None else None,
+            "writesPerEvent": round(writes / events, 3) if events else None,
+            "timersPending": pending,
+            "tickMeanMs": round(sum(durations) / len(durations) * 1000.0, 4) if durations else None,
+            "tickMaxMs": round(max(durations) * 1000.0, 4) if durations else None,
+            "triggersExecuted": len(indigo.trigger.executed),
+            "peakMemoryKB": round(peak / 1024.0, 1)}
+
+
+def case_key(result):
+    return tuple(result[key] for key in ("zones", "sensorsPerZone", "fanout", "triggers", "events", "seed"))
+
+
+def load_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def report(results, baseline):
+    before = {case_key(result): result for result in baseline}
+    columns = ("zones", "eventsPerSec", "usPerEvent", "writesPerEvent", "tickMeanMs", "tickMaxMs", "startupMs", "peakMemoryKB")
+    print("  ".join(f"{column:>14}" for column in columns), file=sys.stderr)
+    for result in results:
+        print("  ".join(f"{result[column]!s:>14}" for column in columns), file=sys.stderr)
+        old = before.get(case_key(result), None)
+        if old is None:
+            continue
+        changes = []
+        for column in columns[1:]:
+            if old.get(column) and result.get(column) is not None:
+                change = (result[column] - old[column]) / old[column] * 100.0
+                worse = change > 0 if column in LOWER_IS_BETTER else change < 0
+                changes.append(f"{change:+13.1f}%" + ("!" if worse and abs(change) >= 10.0 else " "))
+            else:
+                changes.append(f"{'':>14}")
+        print(f"{'vs baseline':>14}  " + " ".join(changes), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--zones", default="10,100,1000,5000", help="comma separated zone counts, one case each")
+    parser.add_argument("--sensors-per-zone", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=2, help="zones watching each sensor, on average")
+    parser.add_argument("--triggers", type=int, default=1, help="triggers per zone per transition")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results here, one JSON object per line, instead of stdout")
+    parser.add_argument("--baseline", help="an earlier --output file to compare against")
+    parser.add_argument("--plugin", default=str(PLUGIN), help="the plugin.py to time, by default this tree's")
+    args = parser.parse_args()
+
+    load_plugin(args.plugin)
+
+    results = []
+    for zones in (int(x) for x in args.zones.split(",")):
+        result = run_case(zones, args.sensors_per_zone, args.fanout, args.triggers, args.events, args.ticks, args.seed)
+        result["python"] = platform.python_version()
+        results.append(result)
+
+    lines = "".join(json.dumps(result, sort_keys=True) + "\n" for result in results)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(lines)
+    else:
+        sys.stdout.write(lines)
+    report(results, load_results(args.baseline) if args.baseline else [])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 """Minimal stub of the Indigo runtime, enough to exercise plugin.py off-server."""
 
+import atexit
+import copy
+import tempfile
+
 
 class Dict(dict):
     pass
@@ -9,6 +13,18 @@ class List(list):
     pass
 
 
+SENSOR_TYPES = ("area", "activityZone", "scoreZone", "sensor")  # the stub's device types that Indigo would make SensorDevices
+
+
+class _SensorDeviceType(type):
+    def __instancecheck__(cls, dev):
+        return getattr(dev, "deviceTypeId", None) in SENSOR_TYPES
+
+
+class SensorDevice(metaclass=_SensorDeviceType):
+    """isinstance(dev, indigo.SensorDevice) for the stub's single Device class."""
+
+
 class kStateImageSel:
     MotionSensor = "motion"
     MotionSensorTripped = "tripped"
@@ -19,13 +35,29 @@ class Device:
         self.id = dev_id
         self.name = name
         self.deviceTypeId = deviceTypeId
-        self.pluginProps = Dict(props or {})
+        self._pluginProps = Dict(props or {})
         self.sharedProps = Dict()
         self.onState = onState
         self.supportsOnState = True
+        self.enabled = True
+        self.displayStateImageSel = None
         self.pluginId = pluginId
+        self.folderId = 0
+        self.description = ""  # the Notes field
         self.states = {}
         self.state_writes = []
+        self.batch_writes = []  # the keys of each updateStatesOnServer call
+        self.shared_writes = 0
+        self.state_list_changes = 0
+
+    @property
+    def pluginProps(self):
+        # a copy, as on the server: edits only stick through replacePluginPropsOnServer
+        return type(self._pluginProps)(self._pluginProps)
+
+    @pluginProps.setter
+    def pluginProps(self, props):
+        self._pluginProps = props
 
     def updateStateOnServer(self, key, value, uiValue=None):
         self.states[key] = value
@@ -33,18 +65,25 @@ class Device:
         if key == "onOffState":
             self.onState = bool(value)
 
-    def updateStateImageOnServer(self, image):
-        self.image = image
+    def updateStatesOnServer(self, updates):
+        self.batch_writes.append([update["key"] for update in updates])
+        for update in updates:
+            self.updateStateOnServer(update["key"], update["value"], update.get("uiValue"))
 
-    def stateListOrDisplayStateIdChanged(self):
-        pass
+    def updateStateImageOnServer(self, image):
+        self.image = self.displayStateImageSel = image
 
     def replaceSharedPropsOnServer(self, props):
         self.sharedProps = Dict(props)
+        self.shared_writes += 1
+
+    def stateListOrDisplayStateIdChanged(self):
+        self.state_list_changes += 1
 
     def replacePluginPropsOnServer(self, props):
-        self.pluginProps = Dict(props)
-        devices._restart(self)
+        old = copy.copy(self)
+        self._pluginProps = Dict(props)
+        devices._props_replaced(old, self)
 
 
 class _Devices:
@@ -52,6 +91,9 @@ class _Devices:
         self._devs = {}
         self.plugin = None
         self.restarts = []
+        self.lookups = 0
+        self.checks = 0  # `in` tests, a server round trip of their own
+        self.scans = 0
 
     def add(self, dev):
         self._devs[dev.id] = dev
@@ -61,24 +103,34 @@ class _Devices:
         self._devs.pop(dev_id, None)
 
     def __contains__(self, key):
+        self.checks += 1
         return key in self._devs
 
     def __getitem__(self, key):
+        self.lookups += 1
         if key not in self._devs:
             raise KeyError(f"key id {key} not found in database")
         return self._devs[key]
 
     def iter(self, filt=None):
+        self.scans += 1
         for dev in list(self._devs.values()):
             if filt == "self" and dev.pluginId != "com.flyingdiver.indigoplugin.occupatum":
                 continue
-            if filt == "indigo.sensor" and dev.deviceTypeId not in ("area", "activityZone", "sensor"):
+            if filt == "indigo.sensor" and not isinstance(dev, SensorDevice):
                 continue
             yield dev
 
     def subscribeToChanges(self):
         pass
 
+    def _props_replaced(self, old, dev):
+        # Indigo restarts the device if the plugin says the change needs it, and otherwise reports it as an update
+        if self.plugin is not None and not self.plugin.didDeviceCommPropertyChange(old, dev):
+            self.plugin.deviceUpdated(old, dev)
+        else:
+            self._restart(dev)
+
     def _restart(self, dev):
         # Indigo stops and restarts a device whose props were replaced
         self.restarts.append(dev.id)
@@ -90,6 +142,20 @@ class _Devices:
 devices = _Devices()
 
 
+_scratch = tempfile.TemporaryDirectory(prefix="indigo-stub-")  # every install folder handed out, gone at exit
+atexit.register(_scratch.cleanup)
+
+
+class server:
+    installFolder = None  # a throwaway folder, made the first time something asks for it
+
+    @staticmethod
+    def getInstallFolderPath():
+        if server.installFolder is None:
+            server.installFolder = tempfile.mkdtemp(dir=_scratch.name)
+        return server.installFolder
+
+
 class trigger:
     executed = []
 
@@ -104,6 +170,7 @@ class PluginBase:
 
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         self.pluginId = pluginId
+        self.stopThread = False
         self.pluginPrefs = pluginPrefs or {}
         import logging
         self.logger = logging.getLogger("occupatum")
@@ -114,11 +181,20 @@ class PluginBase:
         self.indigo_log_handler = logging.NullHandler()
         self.indigo_log_handler.setLevel = lambda *a, **k: None
 
+    def deviceCreated(self, dev):
+        pass
+
     def deviceDeleted(self, dev):
         pass
 
     def deviceUpdated(self, old, new):
         pass
 
+    def didDeviceCommPropertyChange(self, origDev, newDev):
+        return origDev.pluginProps != newDev.pluginProps
+
+    def stopConcurrentThread(self):
+        self.stopThread = True
+
     def sleep(self, secs):
         raise PluginBase.StopThread()
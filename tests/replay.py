@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay a recorded sensor trace through Occupatum offline, on a simulated clock.
+
+    python3 tests/replay.py trace-20240101-080000.txt
+    python3 tests/replay.py trace.txt --set offDelayValue=120 --set Kitchen:activityCount=3
+    python3 tests/replay.py trace.txt --json > result.json
+
+Record a trace with Plugins > Occupatum > Start Recording Sensor Trace; it lands in traces/ under the plugin's
+folder in Indigo's Preferences.  The replay rebuilds the zones, sensors and triggers from the trace header on
+the stub indigo module, with any --set overrides applied to the zone props, and feeds the recorded events
+through the real Plugin class.  Time only moves when the next event or timer is due, so a day of activity
+takes seconds.  Out come the zone transitions, the triggers they fired and how long each zone was occupied.
+
+The replay is only as good as the trace: it sees what the zones saw while recording, and a zone edited
+mid-recording replays with the props it had when recording started.
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import pathlib
+import sys
+
+HERE = pathlib.Path(__file__).resolve().parent
+PLUGIN = HERE.parent / "Occupatum.indigoPlugin" / "Contents" / "Server Plugin" / "plugin.py"
+
+sys.path.insert(0, str(HERE))  # so `import indigo` finds the stub
+import indigo  # noqa: E402
+
+spec = importlib.util.spec_from_file_location("occ_plugin_replay", PLUGIN)
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+
+PLUGIN_ID = "com.flyingdiver.indigoplugin.occupatum"
+TICK = 1e-6  # smallest step the clock takes, so float rounding can't stall it just short of a deadline
+
+
+class SimClock:
+    """Stands in for time.time: returns whatever the replay last set."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ReplayPlugin(mod.Plugin):
+    """The real plugin, noting each transition and the triggers it fires as it happens."""
+
+    def __init__(self, *args):
+        mod.Plugin.__init__(self, *args)
+        self.transitions = []  # (time, zone id, occupied)
+        self.firings = []      # (time, trigger, zone id)
+
+    def check_triggers(self, device, occupied):
+        now = self.clock()
+        self.transitions.append((now, device.id, occupied))
+        for trigger in self.triggerIndex.get((device.id, occupied), {}).values():
+            self.firings.append((now, trigger, device.id))
+        mod.Plugin.check_triggers(self, device, occupied)
+
+
+def load_trace(path):
+    """The trace header and its events as (seconds since the start, sensor id, onState)."""
+    with open(path) as f:
+        if f.readline().strip() != mod.TRACE_HEADER:
+            raise ValueError(f"{path}: not an Occupatum sensor trace")
+        header = json.loads(f.readline())
+        events = []
+        for line in f:
+            if line.strip():
+                offset, sensorID, onState = line.split()
+                events.append((float(offset), int(sensorID), onState == "1"))
+    return header, events
+
+
+def parse_overrides(settings, zones):
+    """--set values as {zone id or None for every zone: {prop: value}}."""
+    byName = {zone["name"]: zone["id"] for zone in zones}
+    overrides = {}
+    for setting in settings:
+        assignment, sep, value = setting.partition("=")
+        target, _, prop = assignment.rpartition(":")
+        if not prop or not sep:
+            raise ValueError(f"--set {setting}: expected [ZONE:]PROP=VALUE")
+        zoneID = None
+        if target:
+            zoneID = byName.get(target, None)
+            if zoneID is None:
+                zoneID = int(target) if target.isdigit() else None
+            if zoneID is None:
+                raise ValueError(f"--set {setting}: no zone named {target}")
+        overrides.setdefault(zoneID, {})[prop] = value
+    return overrides
+
+
+def advance(plugin, clock, until):
+    # what runConcurrentThread does, minus the waiting
+    while True:
+        timeout = plugin.run_timers()
+        if timeout is None or clock.now + timeout > until:
+            break
+        clock.now += max(timeout, TICK)
+    clock.now = max(clock.now, until)
+
+
+def replay(header, events, overrides=None, tail=3600.0):
+    """Run the events through a plugin built from the header, then let the clock run on for `tail` seconds so
+    pending timers finish.  Returns the transitions, trigger firings and per-zone occupied time."""
+    overrides = overrides or {}
+    indigo.devices = indigo._Devices()
+    mod.indigo.devices = indigo.devices
+    indigo.trigger.executed = []
+    indigo.server.installFolder = None  # no snapshot from an earlier run
+
+    for sensor in header["sensors"]:
+        indigo.devices.add(indigo.Device(sensor["id"], sensor["name"], "sensor", onState=sensor["onState"], pluginId="other"))
+    for zone in header["zones"]:
+        props = dict(zone["props"], **overrides.get(None, {}))
+        props.update(overrides.get(zone["id"], {}))
+        indigo.devices.add(indigo.Device(zone["id"], zone["name"], zone["typeId"], props=props, onState=zone["onState"]))
+
+    start = header["started"]
+    clock = SimClock(start)
+    plugin = ReplayPlugin(PLUGIN_ID, "Occupatum", "0", {"logLevel": logging.CRITICAL, "countdownRefresh": "0"})
+    plugin.clock = clock
+    indigo.devices.plugin = plugin
+    plugin.startup()
+    for device in list(indigo.devices.iter("self")):
+        plugin.deviceStartComm(device)
+    for trigger in header["triggers"]:
+        plugin.triggerStartProcessing(type("Trigger", (), {
+            "id": trigger["id"], "name": trigger["name"], "pluginTypeId": trigger["pluginTypeId"],
+            "pluginProps": {"zoneDevice": str(trigger["zoneDevice"])}})())
+
+    for offset, sensorID, onState in events:
+        advance(plugin, clock, start + offset)
+        if sensorID not in indigo.devices:
+            continue
+        sensor = indigo.devices[sensorID]
+        old = indigo.Device(sensorID, sensor.name, "sensor", onState=sensor.onState, pluginId="other")
+        sensor.onState = onState
+        plugin.deviceUpdated(old, sensor)
+    end = start + (events[-1][0] if events else 0.0) + tail
+    advance(plugin, clock, end)
+
+    names = {zone["id"]: zone["name"] for zone in header["zones"]}
+    occupied = {}
+    since = {zone["id"]: start if zone["onState"] else None for zone in header["zones"]}
+    for when, zoneID, state in plugin.transitions:
+        if state and since.get(zoneID) is None:
+            since[zoneID] = when
+        elif not state and since.get(zoneID) is not None:
+            occupied[zoneID] = occupied.get(zoneID, 0.0) + when - since[zoneID]
+            since[zoneID] = None
+    for zoneID, when in since.items():
+        if when is not None:
+            occupied[zoneID] = occupied.get(zoneID, 0.0) + end - when
+
+    return {"events": len(events), "seconds": round(end - start, 3),
+            "transitions": [{"time": round(when - start, 3), "zone": names[zoneID], "occupied": state}
+                            for when, zoneID, state in plugin.transitions],
+            "triggers": [{"time": round(when - start, 3), "trigger": trigger.name, "zone": names[zoneID]}
+                         for when, trigger, zoneID in plugin.firings],
+            "occupiedSeconds": {names[zoneID]: round(occupied.get(zoneID, 0.0), 3) for zoneID in names}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace")
+    parser.add_argument("--set", action="append", default=[], metavar="[ZONE:]PROP=VALUE",
+                        help="override a zone prop, for every zone or just the one named (or numbered); repeatable")
+    parser.add_argument("--tail", type=float, default=3600.0, help="seconds to keep running after the last event")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    header, events = load_trace(args.trace)
+    result = replay(header, events, parse_overrides(args.set, header["zones"]), args.tail)
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+        return
+    lines = [(transition["time"], f"{transition['zone']}  {'occupied' if transition['occupied'] else 'unoccupied'}")
+             for transition in result["transitions"]]
+    lines += [(firing["time"], f"{firing['zone']}  fired {firing['trigger']}") for firing in result["triggers"]]
+    for when, line in sorted(lines, key=lambda x: x[0]):  # stable, so a firing stays after its transition
+        print(f"{when:>12.3f}  {line}")
+    print(f"\n{result['events']} event(s) over {result['seconds']:.0f}s, {len(result['transitions'])} transition(s), "
+          f"{len(result['triggers'])} trigger firing(s)")
+    for name, seconds in result["occupiedSeconds"].items():
+        print(f"    {name}: occupied {seconds:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,14 +11,19 @@ Indigo's embedded interpreter is not what runs this.
 These cover the paths that are painful to exercise on a live server: device deletion, the props-edit restart,
 the two-thread timer races, and plugin startup against a stale config.  What they cannot cover is Indigo
 itself - the stub encodes assumptions about it (notably that replacePluginPropsOnServer synchronously stops
-and restarts the device, and that deviceStopComm sees the post-edit props).  A pass here is evidence, not
+and restarts the device when didDeviceCommPropertyChange says so and otherwise calls deviceUpdated, and that
+deviceStopComm sees the post-edit props).  A pass here is evidence, not
 proof; anything touching those two behaviours still wants a real server before release.
 """
 
+import copy
 import importlib.util
 import logging
+import os
 import pathlib
 import sys
+import threading
+import time
 
 HERE = pathlib.Path(__file__).resolve().parent
 PLUGIN = HERE.parent / "Occupatum.indigoPlugin" / "Contents" / "Server Plugin" / "plugin.py"
@@ -45,6 +50,7 @@ def fresh(zone_props, zone_type="area", sensors=(100, 200), onState=False):
     indigo.devices = indigo._Devices()
     mod.indigo.devices = indigo.devices
     indigo.trigger.executed = []
+    indigo.server.installFolder = None  # a clean data folder, so nothing carries over from the last check
     for sid in sensors:
         indigo.devices.add(indigo.Device(sid, f"Sensor{sid}", "sensor", pluginId="other"))
     zone = indigo.devices.add(indigo.Device(1, "Zone", zone_type, props=zone_props, onState=onState))
@@ -53,9 +59,25 @@ def fresh(zone_props, zone_type="area", sensors=(100, 200), onState=False):
     return plugin, zone
 
 
+def flip(plugin, sensor_id, onState):
+    """Change a sensor's onState and deliver the deviceUpdated Indigo would send for it."""
+    new = indigo.devices[sensor_id]
+    old = copy.copy(new)
+    new.onState = onState
+    plugin.deviceUpdated(old, new)
+
+
 AREA = {"onAnyAll": "any", "onSensorsOnOff": "on", "onDelayValue": "0", "offDelayValue": "0", "forceOffValue": ""}
 
 
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
 def area_props(sensors, **overrides):
     props = dict(AREA, sensorDevices=sensors)
     props.update(overrides)
@@ -83,7 +105,7 @@ props = zone.pluginProps
 props["sensorDevices"] = "100"
 zone.replacePluginPropsOnServer(props)  # a config-dialog edit: stops and restarts the device
 check("sensor removed in the dialog leaves no watchList entry", 200 not in p.watchList, str(p.watchList))
-check("surviving sensor stays registered", p.watchList.get(100) == [1], str(p.watchList))
+check("surviving sensor stays registered", p.watchList.get(100) == {1}, str(p.watchList))
 
 # --- deleting a member sensor ------------------------------------------------------------------------------
 
@@ -92,7 +114,7 @@ p.startup()
 p.deviceStartComm(zone)
 zone.updateStateOnServer(key="onOffState", value=True)  # zone is occupied when the sensor goes away
 trg = type("T", (), {"id": 7, "name": "t", "pluginProps": {"zoneDevice": "1"}, "pluginTypeId": "zoneUnoccupied"})()
-p.triggers[7] = trg
+p.triggerStartProcessing(trg)
 dead = indigo.devices[200]
 indigo.devices.delete(200)
 p.deviceDeleted(dead)
@@ -109,24 +131,25 @@ p, zone = fresh({"sensorDevices": "100,200", "activityCount": "3", "activityWind
                 zone_type="activityZone")
 p.startup()
 p.deviceStartComm(zone)
-p.activityZoneList[1] = [1.0, 2.0, 3.0]
+history = [time.time() - 3, time.time() - 2, time.time() - 1]
+p.zones[1].activity.extend(history)
 dead = indigo.devices[200]
 indigo.devices.delete(200)
 p.deviceDeleted(dead)
-check("surviving sensors keep their activation history", p.activityZoneList.get(1) == [1.0, 2.0, 3.0],
-      str(p.activityZoneList.get(1)))
+check("surviving sensors keep their activation history", list(p.zones[1].activity) == history,
+      str(p.zones[1].activity))
 
 # --- deleting a zone device itself ---------------------------------------------------------------------------
 
 p, zone = fresh(area_props("100,200", onDelayValue="5"))
 p.startup()
 p.deviceStartComm(zone)
-p.delayTimers[1] = (9e9, True)
+p.arm_delay_timer(p.zones[1], 9e9, True)
 indigo.devices.delete(1)
 p.deviceDeleted(zone)
 check("deleting a zone leaves nothing behind",
-      not p.zoneList and not p.watchList and not p.delayTimers and not p.activityZoneList,
-      f"zoneList={p.zoneList} watchList={p.watchList} delayTimers={p.delayTimers}")
+      not p.zones and not p.watchList and not p.zoneWatches and not p.counting and not p.parkedActivity,
+      f"zones={p.zones} watchList={p.watchList} counting={p.counting}")
 
 # --- the timer-dict race that used to kill runConcurrentThread ------------------------------------------------
 
@@ -136,20 +159,31 @@ p.deviceStartComm(zone)
 
 
 class Racy(dict):
-    """Reports the key present, then loses it before the subscript - i.e. the main thread cancelled it."""
+    """The zone set, with Indigo's thread stopping the zone the moment the timer thread looks it up - i.e. the
+    main thread cancels its timer while the timer loop is working through them."""
+    stopper = None
 
-    def __contains__(self, key):
-        return True
+    def get(self, key, default=None):
+        found = dict.get(self, key, default)
+        if Racy.stopper is None and p.worker is not None:
+            Racy.stopper = threading.Thread(target=p.deviceStopComm, args=(zone,))
+            Racy.stopper.start()
+            while not p.events and Racy.stopper.is_alive():  # until the stop is handed over, or has run
+                time.sleep(0.001)
+        return found
 
 
-p.delayTimers = Racy()
-p.forceTimers = Racy()
+p.zones = Racy(p.zones)
+p.arm_delay_timer(p.zones[1], time.time() - 1.0, True)
 try:
     p.runConcurrentThread()
     survived, err = True, ""
 except Exception as exc:  # noqa: BLE001 - any escape at all is the failure
     survived, err = False, f"{type(exc).__name__}: {exc}"
-check("timer thread survives a cancelled-underneath-it timer", survived, err)
+Racy.stopper.join(5.0)
+check("timer thread survives a cancelled-underneath-it timer",
+      survived and not Racy.stopper.is_alive() and 1 not in p.zones and not p.counting,
+      err or f"zones={dict(p.zones)} counting={p.counting}")
 
 # --- props arriving from a script action ----------------------------------------------------------------------
 
@@ -186,6 +220,901 @@ p.deviceStartComm(zone)
 check("an empty 'all' zone is not occupied", zone.onState is False, f"onState={zone.onState}")
 
 
+# --- the timer thread only wakes for pending deadlines ------------------------------------------------------------
+
+p, zone = fresh(area_props("100,200"))
+p.startup()
+p.deviceStartComm(zone)
+p.run_timers()  # let the start-up evaluation settle
+lookups, writes = indigo.devices.lookups, len(zone.state_writes)
+timeout = p.run_timers()
+check("an idle tick touches no zone and sleeps until woken",
+      timeout is None and indigo.devices.lookups == lookups and len(zone.state_writes) == writes,
+      f"timeout={timeout} lookups={indigo.devices.lookups - lookups} writes={len(zone.state_writes) - writes}")
+
+p, zone = fresh(area_props("100", offDelayValue="30"), onState=True)
+p.startup()
+p.deviceStartComm(zone)  # sensor is off, so an off-delay is armed
+p.cancelTimer(type("A", (), {"props": {"state": "unchanged"}})(), zone)
+p.zones[1].delayTimer = (p.timerHeap[0][0] + 1, False)  # re-armed since: the old heap entry must not fire it
+p.timer_due("delay", 1, p.timerHeap[0][0])
+check("a stale heap entry does not complete a re-armed timer", zone.onState is True and p.zones[1].delayTimer,
+      f"onState={zone.onState} delayTimer={p.zones[1].delayTimer}")
+
+p, zone = fresh(area_props("100", countdownRefresh="0"))
+p.clock = FakeClock(1000.0)
+p.startup()
+p.deviceStartComm(zone)
+for n in range(200):  # a busy sensor resetting the force-off timer on every event
+    p.arm_force_timer(p.zones[1], 1100.0 + n)
+p.clock.now = 1020.0  # past the snapshot write they scheduled
+timeout = p.run_timers()
+check("re-armed timers leave no dead entries to wake for, and the heap does not grow with them",
+      timeout == 279.0 and len(p.timerHeap) < mod.TIMER_COMPACT, f"timeout={timeout} heap={len(p.timerHeap)}")
+
+
+# --- countdown refresh writes only what changed ----------------------------------------------------------------
+
+p, zone = fresh(area_props("100", offDelayValue="30", countdownRefresh="10"), onState=True)
+p.startup()
+p.deviceStartComm(zone)  # arms a 30s off-delay
+writes = len(zone.state_writes)
+p.run_timers()
+check("an unchanged countdown is not re-sent", len(zone.state_writes) == writes and zone.states.get("delay_timer") == 30,
+      f"{zone.state_writes[writes:]} delay_timer={zone.states.get('delay_timer')}")
+
+p, zone = fresh(area_props("100", offDelayValue="30", countdownRefresh="0"), onState=True)
+p.startup()
+p.deviceStartComm(zone)
+check("countdowns can be switched off per zone", "delay_timer" not in zone.states and p.zones[1].delayTimer,
+      f"states={zone.states}")
+
+check("threshold countdowns step down through the thresholds",
+      [mod.Plugin.countdown_step(r, "thresholds") for r in (45, 30, 4.2, 0)] == [(60, 30), (30, 10), (5, 0), (0, None)])
+
+
+# --- sensor changes are counted, not rescanned ------------------------------------------------------------------
+
+p, zone = fresh(area_props("100,200,300", onAnyAll="all"), sensors=(100, 200, 300))
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 100, True)
+flip(p, 200, True)
+lookups = indigo.devices.lookups
+flip(p, 300, True)
+p.run_timers()
+check("an 'all' zone goes on from counted member changes", zone.onState is True and p.zones[1].onCount == 3,
+      f"onState={zone.onState} onCount={p.zones[1].onCount}")
+check("a sensor change does not look up the other members", indigo.devices.lookups - lookups <= 3,
+      f"{indigo.devices.lookups - lookups} lookups")
+
+p, zone = fresh(area_props("100,200"))
+p.startup()
+p.deviceStartComm(zone)
+old = copy.copy(indigo.devices[100])
+indigo.devices[100].onState = True  # already on when the zone resyncs, then the delayed deviceUpdated arrives
+p.resync_members(p.zones[1])
+p.deviceUpdated(old, indigo.devices[100])
+check("a change seen at resync is not counted twice", p.zones[1].onCount == 1, f"onCount={p.zones[1].onCount}")
+
+
+# --- zone config is parsed once, at start ---------------------------------------------------------------------
+
+
+class CountingProps(indigo.Dict):
+    reads = 0
+
+    def get(self, *args):
+        CountingProps.reads += 1
+        return indigo.Dict.get(self, *args)
+
+
+p, zone = fresh(area_props("100,200", onDelayValue="5"))
+p.startup()
+p.deviceStartComm(zone)
+zone.pluginProps = CountingProps(zone.pluginProps)
+flip(p, 100, True)
+p.run_timers()
+check("sensor events and timer ticks never read the zone's props", CountingProps.reads == 0,
+      f"{CountingProps.reads} reads")
+
+
+# --- activity history is capped and expires in bulk --------------------------------------------------------------
+
+p, zone = fresh({"sensorDevices": "100", "activityCount": "3", "activityWindow": "60"}, zone_type="activityZone")
+p.startup()
+p.deviceStartComm(zone)
+for _ in range(50):  # a chatty sensor
+    flip(p, 100, True)
+    flip(p, 100, False)
+check("a chatty sensor can't grow the history past activityCount", len(p.zones[1].activity) == 3 and zone.onState,
+      f"{len(p.zones[1].activity)} entries, onState={zone.onState}")
+p.zones[1].activity.clear()
+p.zones[1].activity.extend([time.time() - 90, time.time() - 80, time.time() - 5])
+p.zones[1].activityTimer = None
+p.schedule_activity_expiry(p.zones[1])
+p.run_timers()
+check("every expired time hack goes in one pass", list(p.zones[1].activity)[0] > time.time() - 60 and not zone.onState,
+      f"{list(p.zones[1].activity)} onState={zone.onState}")
+
+
+# --- triggers are indexed by zone and transition -----------------------------------------------------------------
+
+
+def make_trigger(trigger_id, zone_id, type_id):
+    return type("T", (), {"id": trigger_id, "name": f"t{trigger_id}", "pluginProps": {"zoneDevice": str(zone_id)},
+                          "pluginTypeId": type_id})()
+
+
+p, zone = fresh(area_props("100"))
+p.startup()
+p.deviceStartComm(zone)
+for n in range(10):
+    p.triggerStartProcessing(make_trigger(n, 1, "zoneOccupied" if n % 2 else "zoneUnoccupied"))
+    p.triggerStartProcessing(make_trigger(100 + n, 2, "zoneOccupied"))
+p.triggerStartProcessing(make_trigger(99, 1, "zoneBogus"))
+p.check_triggers(zone, True)
+check("a transition fires only its own zone's matching triggers",
+      sorted(t.id for t in indigo.trigger.executed) == [1, 3, 5, 7, 9], str([t.id for t in indigo.trigger.executed]))
+check("an unknown trigger type is rejected at registration", 99 not in p.triggers, str(p.triggers.get(99)))
+p.triggerStopProcessing(make_trigger(99, 1, "zoneBogus"))
+for n in range(10):
+    p.triggerStopProcessing(make_trigger(n, 1, ""))
+    p.triggerStopProcessing(make_trigger(100 + n, 2, ""))
+check("stopping every trigger empties the index", not p.triggers and not p.triggerIndex, str(p.triggerIndex))
+
+
+# --- the watch index is kept in both directions ------------------------------------------------------------------
+
+p, zone = fresh(area_props("100,200"), sensors=(100, 200, 300))
+other = indigo.devices.add(indigo.Device(2, "Other", "area", props=area_props("200,300")))
+p.startup()
+p.deviceStartComm(zone)
+p.deviceStartComm(other)
+p.deviceStartComm(zone)  # a second start without a stop must not double-register
+check("sensor and zone views of the watch index agree",
+      p.watchList == {100: {1}, 200: {1, 2}, 300: {2}} and p.zoneWatches == {1: {100, 200}, 2: {200, 300}},
+      f"watchList={p.watchList} zoneWatches={p.zoneWatches}")
+p.forget_zone(2)
+check("forgetting a zone drops only its registrations", p.watchList == {100: {1}, 200: {1}}, str(p.watchList))
+
+
+# --- bursts of sensor events are coalesced per zone ---------------------------------------------------------------
+
+sensors = tuple(range(100, 120))
+p, zone = fresh(area_props(",".join(str(x) for x in sensors), onDelayValue="5", coalesceWindow="50"), sensors=sensors)
+p.startup()
+p.deviceStartComm(zone)
+writes = p.zones[1].stats["writes"]
+for sid in sensors:  # an "all on" broadcast
+    flip(p, sid, True)
+check("a burst is held until the coalescing window closes", p.zones[1].stats["writes"] == writes and p.zones[1].burstEvents == 20,
+      f"writes={p.zones[1].stats['writes'] - writes} burstEvents={p.zones[1].burstEvents}")
+time.sleep(0.06)
+p.run_timers()
+check("a burst is evaluated once", p.counters["bursts"] == 1 and p.counters["burstEvents"] == 20
+      and p.zones[1].delayTimer[1] is True, f"{dict(p.counters)} delayTimer={p.zones[1].delayTimer}")
+
+
+# --- re-evaluating to the same outcome changes nothing -------------------------------------------------------------
+
+p, zone = fresh(area_props("100,200", onDelayValue="5"))
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 100, True)
+deadline = p.zones[1].delayTimer[0]
+writes = p.zones[1].stats["writes"]
+flip(p, 200, True)  # more activity in a busy room
+check("a pending delay to the same state is not slid forward",
+      p.zones[1].delayTimer[0] == deadline and p.zones[1].stats["writes"] == writes and p.counters["rearmsSkipped"] == 1,
+      f"moved by {p.zones[1].delayTimer[0] - deadline:.3f}s, {p.zones[1].stats['writes'] - writes} writes")
+flip(p, 100, False)
+flip(p, 200, False)  # back to unoccupied before the on-delay ran out
+check("a delay for a reverted condition is cancelled", p.zones[1].delayTimer is None and zone.onState is False,
+      f"delayTimer={p.zones[1].delayTimer}")
+
+p, zone = fresh(area_props("100,200", forceOffValue="600", forceOffRearm=False))
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 100, True)
+p.run_timers()
+deadline = p.zones[1].forceTimer
+flip(p, 200, True)
+check("force off is not restarted by activity when forceOffRearm is off", p.zones[1].forceTimer == deadline,
+      f"{p.zones[1].forceTimer} != {deadline}")
+
+p, zone = fresh(area_props("100", forceOffValue="600", forceOffRearm="false"))  # as a script would leave it
+p.startup()
+p.deviceStartComm(zone)
+check("forceOffRearm given as the string 'false' turns re-arming off", p.zones[1].forceOffRearm is False,
+      repr(p.zones[1].forceOffRearm))
+
+
+# --- hot-path logging --------------------------------------------------------------------------------------------
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.records = []
+
+    def __getattr__(self, level):
+        return lambda msg, *args: self.records.append((level, msg % args if args else msg))
+
+
+p, zone = fresh(area_props(""))
+p.startup()
+p.deviceStartComm(zone)
+p.logger = RecordingLogger()
+for _ in range(20):
+    p.check_sensors(zone, False)
+check("a per-event warning is not repeated for every event", len(p.logger.records) == 0, str(p.logger.records[:3]))
+p.zones[1].warned["no sensors"][0] -= mod.WARNING_INTERVAL
+p.check_sensors(zone, False)
+check("the next warning through counts what was suppressed",
+      len(p.logger.records) == 1 and "20 similar" in p.logger.records[0][1], str(p.logger.records))
+
+p, zone = fresh(area_props("100,200", debugZone=True))
+other = indigo.devices.add(indigo.Device(2, "Other", "area", props=area_props("100,200")))
+p.startup()
+p.deviceStartComm(zone)
+p.deviceStartComm(other)
+p.logger = RecordingLogger()
+flip(p, 100, True)
+traced = {msg.split(":")[0] for _, msg in p.logger.records}
+check("debugging one zone traces only that zone", "[debug] Zone" in traced and "[debug] Other" not in traced, str(traced))
+
+p, zone = fresh(area_props("100", debugZone="false"))  # as a script would leave it
+p.startup()
+p.deviceStartComm(zone)
+check("debugZone given as the string 'false' leaves the zone's debugging off", p.zones[1].debug is False,
+      repr(p.zones[1].debug))
+
+p, zone = fresh(area_props("100"))
+logging.disable(logging.NOTSET)
+p.logger.setLevel(logging.DEBUG)  # as Indigo leaves a plugin's logger
+p.closedPrefsConfigUi({"logLevel": "20"}, False)
+toFile = p.debugAll
+p.plugin_file_handler.setLevel(logging.INFO)
+p.closedPrefsConfigUi({"logLevel": "20"}, False)
+check("the hot paths still trace to the plugin log file with the event log at INFO", toFile and not p.debugAll,
+      f"toFile={toFile} quiet={not p.debugAll}")
+p.logger.setLevel(logging.NOTSET)
+logging.disable(logging.CRITICAL)
+
+
+# --- performance stats -----------------------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100,200", onDelayValue="0.2"))  # just long enough to need a timer
+p.startup()
+p.deviceStartComm(zone)
+p.run_timers()
+trg = make_trigger(11, 1, "zoneOccupied")
+p.triggerStartProcessing(trg)
+flip(p, 100, True)
+sensor = indigo.devices[100]
+p.deviceUpdated(copy.copy(sensor), sensor)  # some other state of the sensor changed
+time.sleep(0.21)
+p.run_timers()
+stats = p.performance_stats()
+zstats = stats["zones"][0]
+check("events, evaluations, timers and triggers are counted per zone",
+      zstats["eventsReceived"] == 1 and zstats["evaluations"] == 2 and zstats["timersArmed"]["delay"] == 1
+      and zstats["timersFired"]["delay"] == 1 and zstats["triggersExecuted"] == 1
+      and stats["counters"]["eventsIgnored"] == 1, str(stats))
+check("state writes are counted by key", zstats["stateWrites"]["onOffState"] >= 1
+      and sum(zstats["stateWrites"].values()) == zstats["writes"], str(zstats))
+latency = stats["latency"]
+check("event-to-transition and timer lateness are measured",
+      latency["eventToTransition"]["count"] == 1 and latency["eventToTransition"]["maxMs"] >= 10
+      and latency["timerLateness"]["count"] == 1 and latency["tick"]["count"] >= 2, str(latency))
+reply = p.getPerformanceStats(None)
+check("scripts get the stats as an indigo.Dict", isinstance(reply, indigo.Dict)
+      and isinstance(reply["zones"], indigo.List) and isinstance(reply["zones"][0], indigo.Dict), str(type(reply)))
+p.logger = RecordingLogger()
+p.printPerformanceStats()
+check("the stats print to the log", any("Zone:" in msg for _, msg in p.logger.records), str(p.logger.records))
+p.resetPerformanceStats()
+flip(p, 100, False)
+check("reset clears plugin-wide and zone counters",
+      p.counters["eventsReceived"] == 1 and p.zones[1].stats["eventsReceived"] == 1
+      and p.performance_stats()["latency"]["timerLateness"]["count"] == 0, str(p.performance_stats()))
+
+
+# --- sensor traces record and replay ------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100,200", offDelayValue="60"))
+p.startup()
+p.deviceStartComm(zone)
+p.triggerStartProcessing(make_trigger(21, 1, "zoneUnoccupied"))
+p.clock = FakeClock(1000.0)
+p.startTraceRecording()
+flip(p, 100, True)
+p.clock.now += 30
+flip(p, 100, False)
+p.clock.now += 600
+flip(p, 200, True)
+p.clock.now += 10
+flip(p, 200, False)
+path = p.traceFile.name
+p.stopTraceRecording()
+with open(path) as f:
+    lines = f.read().splitlines()
+check("a trace is a header, a snapshot and one line per sensor event",
+      lines[0] == mod.TRACE_HEADER and lines[2:] == ["0.000 100 1", "30.000 100 0", "630.000 200 1", "640.000 200 0"],
+      str(lines))
+
+spec = importlib.util.spec_from_file_location("occ_replay", HERE / "replay.py")
+replay = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(replay)
+header, events = replay.load_trace(path)
+result = replay.replay(header, events, tail=120)
+check("a replay reproduces the transitions on the simulated clock",
+      [(t["time"], t["occupied"]) for t in result["transitions"]] == [(0.0, True), (90.0, False), (630.0, True), (700.0, False)]
+      and [t["time"] for t in result["triggers"]] == [90.0, 700.0] and result["occupiedSeconds"]["Zone"] == 160.0,
+      str(result))
+result = replay.replay(header, events, replay.parse_overrides(["Zone:offDelayValue=900"], header["zones"]), tail=1000)
+check("a replay applies prop overrides", [(t["time"], t["occupied"]) for t in result["transitions"]] == [(0.0, True), (1540.0, False)],
+      str(result["transitions"]))
+
+
+# --- nested zones ---------------------------------------------------------------------------------------------
+
+def nested_home():
+    """Zone 1 contains zones 2 and 4, zone 2 contains zone 3, and zones 3 and 4 both watch sensor 100."""
+    p, top = fresh(area_props("2,4"), sensors=(100,))
+    indigo.devices.add(indigo.Device(2, "Middle", "area", props=area_props("3")))
+    indigo.devices.add(indigo.Device(3, "Bottom", "area", props=area_props("100")))
+    indigo.devices.add(indigo.Device(4, "Side", "area", props=area_props("100")))
+    p.startup()
+    for zone_id in (3, 4, 2, 1):
+        p.deviceStartComm(indigo.devices[zone_id])
+    return p, top
+
+
+p, top = nested_home()
+check("a cycle any number of levels down is caught, past a nested zone that doesn't loop",
+      p.is_recursive(3, "Bottom", "4,1") and not p.is_recursive(3, "Bottom", "100,4"))
+check("nested zones are ranked by depth", [p.zone_rank(x) for x in (1, 2, 3, 4)] == [2, 1, 0, 0],
+      str([p.zone_rank(x) for x in (1, 2, 3, 4)]))
+p.run_timers()
+flip(p, 100, True)  # 0s delays, so every level changes in the event path
+check("a sensor change reaches every enclosing zone without the server relaying it",
+      all(indigo.devices[x].onState for x in (1, 2, 3, 4)) and p.zones[1].stats["eventsPropagated"] == 2,
+      str({x: indigo.devices[x].onState for x in (1, 2, 3, 4)}))
+old = copy.copy(indigo.devices[3])
+old.onState = False
+p.deviceUpdated(old, indigo.devices[3])  # the server catching up
+check("the server's own update for a propagated change is ignored",
+      p.zones[2].stats["eventsIgnored"] == 1 and p.zones[2].stats["evaluations"] == 2, str(p.zones[2].stats))
+
+p, top = nested_home()
+p.run_timers()
+p.triggerStartProcessing(make_trigger(21, 1, "zoneOccupied"))
+p.triggerStartProcessing(make_trigger(22, 1, "zoneUnoccupied"))
+flip(p, 100, True)
+flip(p, 100, False)
+fired = [t.id for t in indigo.trigger.executed]
+for state in (True, False):  # the server's echoes for zone 3, arriving after it has already gone on and off
+    old = copy.copy(indigo.devices[3])
+    old.onState, echo = not state, copy.copy(indigo.devices[3])
+    echo.onState = state
+    p.deviceUpdated(old, echo)
+check("late echoes of a nested zone's changes don't re-run the zones above it",
+      fired == [21, 22] and [t.id for t in indigo.trigger.executed] == fired and not top.onState
+      and p.zones[2].stats["eventsIgnored"] == 2, f"fired={[t.id for t in indigo.trigger.executed]} stats={dict(p.zones[2].stats)}")
+
+p, top = nested_home()
+p.run_timers()
+seen = []
+for zone_id in (1, 2, 3):
+    p.triggerStartProcessing(make_trigger(zone_id, zone_id, "zoneOccupied"))
+execute = indigo.trigger.execute
+indigo.trigger.execute = lambda trg: seen.append((trg.id, indigo.devices[3].displayStateImageSel))
+flip(p, 100, True)
+indigo.trigger.execute = execute
+check("an enclosing zone's transition follows its nested zone's, triggers included",
+      seen == [(3, "tripped"), (2, "tripped"), (1, "tripped")], str(seen))
+
+p, top = nested_home()
+ranks = dict(p.zoneRanks)
+indigo.devices.add(indigo.Device(5, "Corner", "area", props=area_props("100")))
+p.deviceStartComm(indigo.devices[5])
+untouched = p.zoneRanks == ranks
+reranked = p.counters["zonesReranked"]
+props = indigo.devices[3].pluginProps
+props["sensorDevices"] = "100,5"
+indigo.devices[3].replacePluginPropsOnServer(props)  # zone 5 now nested in zone 3
+check("a zone that nests nothing and is nested nowhere leaves every rank alone", untouched, str(p.zoneRanks))
+check("nesting a zone re-ranks only it and the zones above it",
+      p.zoneRanks == {1: 3, 2: 2, 3: 1, 4: 0, 5: 0} and p.counters["zonesReranked"] - reranked == 6,
+      f"{p.zoneRanks} reranked={p.counters['zonesReranked'] - reranked}")
+
+
+# --- the config dialogs list sensors from an index, not the device database -------------------------------------
+
+p, zone = fresh(area_props("100"), sensors=(100, 200, 300))
+p.startup()
+p.deviceStartComm(zone)
+indigo.devices[300].name = "Attic"
+listed = p.sensorDevices(valuesDict={"sensorDevices": "100"}, targetId=1)
+check("candidates are sorted by name and leave out members and the zone itself",
+      listed == [("300", "Attic"), ("200", "Sensor200")], str(listed))
+new = indigo.devices.add(indigo.Device(400, "Basement", "sensor", pluginId="other"))
+p.deviceCreated(new)
+old = copy.copy(indigo.devices[200])
+indigo.devices[200].name = "Bedroom"
+p.deviceUpdated(old, indigo.devices[200])
+indigo.devices.delete(300)
+p.deviceDeleted(type("Deleted", (), {"id": 300, "name": "Attic"})())
+scans, lookups = indigo.devices.scans, indigo.devices.lookups
+listed = p.sensorDevices(valuesDict={"sensorDevices": "100"}, targetId=1)
+members = p.sensorDeviceList(valuesDict={"sensorDevices": "100,200"}, targetId=1)
+check("creates, renames and deletes keep the index current",
+      listed == [("400", "Basement"), ("200", "Bedroom")] and members == [("100", "Sensor100"), ("200", "Bedroom")],
+      f"{listed} {members}")
+check("refreshing a dialog doesn't touch the device database",
+      indigo.devices.scans == scans and indigo.devices.lookups == lookups,
+      f"scans={indigo.devices.scans - scans} lookups={indigo.devices.lookups - lookups}")
+
+
+# --- cold start ----------------------------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100,999"))
+p.logger = RecordingLogger()
+p.startup()  # prunes 999, and the props write starts the zone
+started = p.zones[1]
+p.deviceStartComm(zone)  # Indigo's own start for it
+check("a zone started by its pruning write isn't started twice", p.zones[1] is started and indigo.devices.restarts == [1],
+      f"restarts={indigo.devices.restarts}")
+reports = [msg for _, msg in p.logger.records if msg.startswith("Started ")]
+check("startup logs one timing breakdown once every zone is up", len(reports) == 1 and "1 pruned" in reports[0], str(reports))
+
+p, zone = fresh(area_props("100"))
+bad = indigo.devices.add(indigo.Device(2, "Retired", "retiredType"))
+p.logger = RecordingLogger()
+p.startup()
+p.deviceStartComm(bad)
+p.deviceStartComm(zone)
+reports = [msg for _, msg in p.logger.records if msg.startswith("Started ")]
+check("a device of an unknown type doesn't hold up the startup report",
+      len(reports) == 1 and reports[0].startswith("Started 1 zone(s)"), str(reports))
+
+p, zone = fresh(area_props("100"))
+zone.states.update(delay_timer=0, force_off_timer=0)
+p.startup()
+p.deviceStartComm(zone)
+writes = (zone.shared_writes, zone.state_list_changes, len(zone.state_writes))
+p.deviceStopComm(zone)
+p.deviceStartComm(zone)
+check("a restart with nothing changed writes nothing to the server",
+      (zone.shared_writes, zone.state_list_changes, len(zone.state_writes)) == writes == (1, 0, 0),
+      f"{writes} -> {(zone.shared_writes, zone.state_list_changes, len(zone.state_writes))}")
+
+
+# --- timers and activity survive a plugin restart ----------------------------------------------------------------
+
+def restart_plugin(old):
+    """Stop every zone and the plugin the way Indigo does, then start a new plugin instance on the same data."""
+    for device in list(indigo.devices.iter("self")):
+        old.deviceStopComm(device)
+    old.shutdown()
+    plugin = mod.Plugin(PLUGIN_ID, "Occupatum", "0", {"logLevel": 50})
+    indigo.devices.plugin = plugin
+    plugin.startup()
+    for device in list(indigo.devices.iter("self")):
+        plugin.deviceStartComm(device)
+    return plugin
+
+
+p, zone = fresh(area_props("100", offDelayValue="600", forceOffValue="900"), onState=True)
+p.startup()
+p.deviceStartComm(zone)
+delayTimer, forceTimer = p.zones[1].delayTimer, p.zones[1].forceTimer
+flip(p, 100, True)
+flip(p, 100, False)
+check("the snapshot is written on a schedule, not per event", p.counters["snapshotsSaved"] == 0 and p.snapshotDue is not None,
+      str(dict(p.counters)))
+delayTimer = p.zones[1].delayTimer
+p = restart_plugin(p)
+check("a pending delay resumes with its original deadline after a restart",
+      p.zones[1].delayTimer == delayTimer and zone.onState is True, f"{p.zones[1].delayTimer} != {delayTimer}")
+
+p.zones[1].delayTimer = (time.time() - 5, False)  # as if it ran out while the plugin was down
+p.snapshot_changed(p.zones[1])
+p = restart_plugin(p)
+p.run_timers()
+check("a delay that ran out while the plugin was down completes on the first tick",
+      zone.onState is False and p.zones[1].delayTimer is None, f"onState={zone.onState}")
+
+p, zone = fresh({"sensorDevices": "100", "activityCount": "3", "activityWindow": "60"}, zone_type="activityZone")
+p.startup()
+p.deviceStartComm(zone)
+now = time.time()
+p.zones[1].activity.extend([now - 120, now - 10, now - 5])
+p.snapshot_changed(p.zones[1])
+p = restart_plugin(p)
+check("activity is restored without the activations that aged out", list(p.zones[1].activity) == [now - 10, now - 5],
+      str(list(p.zones[1].activity)))
+
+
+# --- occupancy history -------------------------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100"))
+p.clock = FakeClock(time.mktime((2026, 3, 10, 8, 0, 0, 0, 0, -1)))
+midnight = time.mktime((2026, 3, 10, 0, 0, 0, 0, 0, -1))
+p.startup()
+p.deviceStartComm(zone)
+for hours, state in ((0, True), (1, False), (3, True)):
+    p.clock.now = midnight + (8 + hours) * 3600
+    flip(p, 100, state)
+    p.run_timers()
+p.clock.now = midnight + 13 * 3600
+today = p.occupancy_summary([1])[1]
+check("a day's occupancy comes from the history log",
+      today == {"occupiedSeconds": 3 * 3600, "occupiedTransitions": 2, "vacantTransitions": 1,
+                "longestOccupied": 2 * 3600, "longestVacant": 8 * 3600}, str(today))
+p.clock.now = midnight + (24 + 9) * 3600
+flip(p, 100, False)
+p.run_timers()
+p.clock.now = midnight + (24 + 12) * 3600
+days = p.occupancy_summary([1], "2026-03-10", "2026-03-11 12:00", byDay=True)[1]["days"]
+check("a range splits into days, each starting from the state the last one ended in",
+      [(d["day"], d["occupiedSeconds"]) for d in days] == [("2026-03-10", 14 * 3600), ("2026-03-11", 9 * 3600)], str(days))
+check("each day's log is one fixed-width record per transition after a checkpoint",
+      [os.path.getsize(p.history.path(day)) for day in ("2026-03-10", "2026-03-11")]
+      == [4 * mod.HISTORY_RECORD.size, 2 * mod.HISTORY_RECORD.size])
+reply = p.getOccupancyHistory(type("A", (), {"props": {"start": "2026-03-11"}})(), zone)
+check("scripts get the same totals from the action", reply["status"] and reply["vacantTransitions"] == 1
+      and reply["occupiedSeconds"] == 9 * 3600, str(reply))
+
+# --- timing edits apply in place ---------------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100", offDelayValue="60"))
+p.clock = FakeClock(1000.0)
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 100, True)
+p.run_timers()
+flip(p, 100, False)  # off delay pending until 1060
+running = p.zones[1]
+p.clock.now = 1010.0
+action = type("A", (), {"props": {"onDelayValue": "0", "offDelayValue": "30", "forceOffValue": "0"}})()
+p.updateOccupancyZone(action, zone)
+check("a timing change reschedules the pending delay without a restart",
+      p.zones[1] is running and indigo.devices.restarts == [] and running.delayTimer == (1030.0, False),
+      f"restarts={indigo.devices.restarts}, delayTimer={running.delayTimer}")
+p.clock.now = 1030.0
+p.run_timers()
+check("the rescheduled delay completes at its new deadline", not zone.onState, f"onState={zone.onState}")
+
+props = zone.pluginProps
+props["offDelayValue"] = "5"
+zone.replacePluginPropsOnServer(props)  # a dialog edit that leaves the members alone
+check("a dialog edit of the timing alone is applied in place", p.zones[1] is running and running.offDelay == 5.0
+      and indigo.devices.restarts == [], f"restarts={indigo.devices.restarts}, offDelay={running.offDelay}")
+props["sensorDevices"] = "100,200"
+zone.replacePluginPropsOnServer(props)
+check("a change of members still restarts the zone", indigo.devices.restarts == [1] and p.zones[1] is not running,
+      f"restarts={indigo.devices.restarts}")
+
+# --- bulk actions ------------------------------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100", offDelayValue="60"))
+for zoneID in (2, 3):
+    indigo.devices.add(indigo.Device(zoneID, f"Zone{zoneID}", "area", props=area_props("200", offDelayValue="60")))
+indigo.devices[2].folderId = indigo.devices[3].folderId = 9
+indigo.devices[3].description = "bedroom #night"
+activity = indigo.devices.add(indigo.Device(4, "Activity", "activityZone", props={"sensorDevices": "100", "activityCount": "2", "activityWindow": "60"}))
+p.startup()
+for device in list(indigo.devices.iter("self")):
+    p.deviceStartComm(device)
+action = type("A", (), {"props": {"zones": ["1", "3", "4", "99"], "onDelayValue": "0", "offDelayValue": "10", "forceOffValue": ""}})()
+reply = p.bulkUpdateOccupancyZones(action)
+zones = reply.get("zones", {})
+check("a bulk update applies to every zone it can and reports each one",
+      p.zones[1].offDelay == p.zones[3].offDelay == 10.0 and p.zones[2].offDelay == 60.0
+      and zones["1"]["status"] and zones["3"]["status"] and not zones["4"]["status"] and not zones["99"]["status"]
+      and not reply["status"] and indigo.devices.restarts == [], repr(reply))
+check("a bulk update persists the props", indigo.devices[3].pluginProps["offDelayValue"] == "10",
+      indigo.devices[3].pluginProps["offDelayValue"])
+
+action = type("A", (), {"props": {"zoneFolder": "9", "onDelayValue": "0", "offDelayValue": "30", "forceOffValue": ""}})()
+reply = p.bulkUpdateOccupancyZones(action)
+check("a folder selects the zones of the action's type in it", reply["status"] and sorted(reply["zones"]) == ["2", "3"],
+      repr(reply))
+reply = p.bulkForceZonesOff(type("A", (), {"props": {"zoneTag": "#Night"}})())
+check("a tag in the Notes selects zones", reply["status"] and list(reply["zones"]) == ["3"], repr(reply))
+action = type("A", (), {"props": {"zones": "1,2", "offDelayValue": "x", "onDelayValue": "0", "forceOffValue": ""}})()
+reply = p.bulkUpdateOccupancyZones(action)
+check("bad parameters fail the whole action before any zone is touched",
+      not reply["status"] and "offDelayValue" in reply["errors"] and "zones" not in reply and p.zones[1].offDelay == 10.0,
+      repr(reply))
+reply = p.bulkForceZonesOff(type("A", (), {"props": {"zones": "1", "zoneTag": "night"}})())
+check("a bulk action needs exactly one way of selecting zones", not reply["status"] and "selectBy" in reply["errors"],
+      repr(reply))
+
+# --- one writer: the worker drains the event queue --------------------------------------------------------------
+
+p, zone = fresh(area_props("100"))
+p.startup()
+p.deviceStartComm(zone)
+p.worker = -1  # a worker running on some other thread
+flip(p, 100, True)
+check("with a worker running, a sensor event is queued for it", len(p.events) == 1 and p.zones[1].onCount == 0,
+      f"queued={len(p.events)}, onCount={p.zones[1].onCount}")
+p.worker = None
+p.drain_events()
+check("the drain applies it", p.zones[1].onCount == 1 and p.counters["queuedEvents"] == 1 and not p.events,
+      f"onCount={p.zones[1].onCount}, counters={dict(p.counters)}")
+
+p, zone = fresh(area_props("100,200"))
+p.startup()
+p.deviceStartComm(zone)
+stopping = threading.Event()
+
+
+def sleep(seconds):
+    if stopping.is_set():
+        raise p.StopThread()
+
+
+writers = set()
+evaluate = p.check_sensors
+
+
+def recording_check_sensors(*args):
+    writers.add(threading.get_ident())
+    return evaluate(*args)
+
+
+p.sleep = sleep
+p.check_sensors = recording_check_sensors
+worker = threading.Thread(target=p.runConcurrentThread)
+worker.start()
+while p.worker is None:
+    time.sleep(0.001)
+for n in range(200):
+    sensor = indigo.devices[100 + 100 * (n % 2)]
+    old = copy.copy(sensor)
+    sensor.onState = n % 4 < 2
+    p.deviceUpdated(old, copy.copy(sensor))  # Indigo hands each callback its own copies
+reply = p.forceZoneOff(type("A", (), {"props": {}})(), zone)
+stopping.set()
+p.wakeup.set()
+worker.join(5.0)
+check("sensor events from Indigo's thread are applied by the worker alone", writers == {worker.ident},
+      f"{len(writers)} writer thread(s)")
+check("a waiting action gets its reply from the worker, and nothing is left queued",
+      reply["status"] and not p.events and p.worker is None and p.zones[1].onCount == 0,
+      f"reply={reply}, queued={len(p.events)}, onCount={p.zones[1].onCount}")
+
+p, zone = fresh(area_props("100", offDelayValue="60"))
+p.startup()
+p.deviceStartComm(zone)
+stopping = threading.Event()
+p.sleep = sleep
+writers = []
+replace = zone.replacePluginPropsOnServer
+zone.replacePluginPropsOnServer = lambda props: (writers.append(threading.get_ident()), replace(props))
+worker = threading.Thread(target=p.runConcurrentThread)
+worker.start()
+while p.worker is None:
+    time.sleep(0.001)
+action = type("A", (), {"props": {"onDelayValue": "0", "offDelayValue": "30", "forceOffValue": "0"}})()
+reply = p.updateOccupancyZone(action, zone)
+stopping.set()
+p.wakeup.set()
+worker.join(5.0)
+check("an update action writes the props from Indigo's thread, not while it waits on the worker",
+      reply["status"] and writers == [threading.get_ident()] and zone.pluginProps["offDelayValue"] == "30",
+      f"reply={reply} writers={writers} main={threading.get_ident()}")
+
+p, zone = fresh(area_props("100,200"))
+p.startup()
+p.deviceStartComm(zone)
+stopping = threading.Event()
+p.sleep = sleep
+writers = []
+replace = zone.replacePluginPropsOnServer
+zone.replacePluginPropsOnServer = lambda props: (writers.append(threading.get_ident()), replace(props))
+worker = threading.Thread(target=p.runConcurrentThread)
+worker.start()
+while p.worker is None:
+    time.sleep(0.001)
+dead = indigo.devices[200]
+indigo.devices.delete(200)
+p.deviceDeleted(dead)
+stopping.set()
+p.wakeup.set()
+worker.join(5.0)
+check("a deleted member is pruned from the props from Indigo's thread, not while it waits on the worker",
+      writers == [threading.get_ident()] and zone.pluginProps["sensorDevices"] == "100",
+      f"writers={writers} main={threading.get_ident()} sensors={zone.pluginProps['sensorDevices']}")
+
+p, zone = fresh(area_props("100"))
+zone.folderId = 9
+p.startup()
+p.deviceStartComm(zone)
+stopping = threading.Event()
+p.sleep = sleep
+readers = set()
+select = p.select_zones
+p.select_zones = lambda *args: (readers.add(threading.get_ident()), select(*args))[1]
+worker = threading.Thread(target=p.runConcurrentThread)
+worker.start()
+while p.worker is None:
+    time.sleep(0.001)
+valid = p.validateActionConfigUi({"zoneFolder": "9", "state": "off"}, "bulkCancelTimer", 0)
+stopping.set()
+p.wakeup.set()
+worker.join(5.0)
+check("validating a bulk action's zone selection reads the zones on the worker", valid[0] and readers == {worker.ident},
+      f"valid={valid} readers={readers} worker={worker.ident}")
+
+p, zone = fresh(area_props("100"))
+p.startup()
+p.deviceStartComm(zone)
+p.worker = -1  # busy on something else, and never getting round to this
+timeout, mod.CALL_TIMEOUT = mod.CALL_TIMEOUT, 0.01
+p.logger = RecordingLogger()
+reply = p.getPerformanceStats(None)
+mod.CALL_TIMEOUT = timeout
+p.worker = None
+p.events.clear()
+check("a callback the worker never answers gives up and says so",
+      reply is None and p.counters["callTimeouts"] == 1 and p.logger.records[0][0] == "error", str(p.logger.records))
+
+# --- zero delays skip the timer ----------------------------------------------------------------------------------
+
+p, zone = fresh(area_props("100", onDelayValue="0", offDelayValue="0"))
+p.startup()
+p.deviceStartComm(zone)
+p.triggerStartProcessing(make_trigger(31, 1, "zoneOccupied"))
+before = len(zone.state_writes)
+flip(p, 100, True)
+check("a zero delay transitions inside the event, trigger and all", zone.onState and [t.id for t in indigo.trigger.executed] == [31]
+      and zone.image == indigo.kStateImageSel.MotionSensorTripped, f"onState={zone.onState}, executed={indigo.trigger.executed}")
+check("without arming a timer or showing a countdown",
+      "timersArmed.delay" not in p.counters and not p.timerHeap and p.counters["immediateTransitions"] == 1
+      and [key for key, _, _ in zone.state_writes[before:]] == ["onOffState"], str(zone.state_writes[before:]))
+props = zone.pluginProps
+props["offDelayValue"] = "60"
+zone.replacePluginPropsOnServer(props)
+flip(p, 100, False)
+flip(p, 100, True)
+check("a pending delay the other way is simply cancelled", zone.onState and p.zones[1].delayTimer is None
+      and p.counters["immediateTransitions"] == 1, f"delayTimer={p.zones[1].delayTimer}")
+
+# --- the event and timer paths work from the device shadows -------------------------------------------------------
+
+p, zone = fresh(area_props("100,200", onAnyAll="all"))
+p.startup()
+p.deviceStartComm(zone)
+sensor = indigo.devices[100]
+lookups, checks = indigo.devices.lookups, indigo.devices.checks
+for onState in (True, False) * 10:
+    old = copy.copy(sensor)
+    sensor.onState = onState
+    p.deviceUpdated(old, sensor)
+p.run_timers()
+check("sensor events that change no state never ask the server about a device",
+      indigo.devices.lookups == lookups and indigo.devices.checks == checks and p.counters["evaluations"] >= 20,
+      f"lookups={indigo.devices.lookups - lookups} checks={indigo.devices.checks - checks}")
+props = zone.pluginProps
+props["onAnyAll"] = "any"
+zone.replacePluginPropsOnServer(props)
+lookups = indigo.devices.lookups
+old = copy.copy(sensor)
+sensor.onState = True
+p.deviceUpdated(old, sensor)
+check("a transition fetches the zone device once, to write it", zone.onState and indigo.devices.lookups - lookups == 1
+      and p.shadows[1].onState, f"onState={zone.onState} lookups={indigo.devices.lookups - lookups}")
+old = copy.copy(zone)
+old.name, zone.name = zone.name, "Renamed"
+p.deviceUpdated(old, zone)
+indigo.devices.delete(200)
+p.deviceDeleted(indigo.Device(200, "Sensor200", "sensor", pluginId="other"))
+check("renames and deletions reach the shadows", p.shadows[1].name == p.zones[1].name == "Renamed" and 200 not in p.shadows,
+      f"name={p.shadows[1].name} shadows={sorted(p.shadows)}")
+
+# --- weighted zones ----------------------------------------------------------------------------------------------
+
+p, zone = fresh({"sensorDevices": "100,200", "sensorWeights": "100:3:0,200:2:0", "onScore": "3", "offScore": "2"},
+                zone_type="scoreZone")
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 200, True)
+on_alone = zone.onState
+flip(p, 100, True)
+check("a weighted zone goes on once the weights reach the occupied score",
+      not on_alone and zone.onState and zone.states.get("score") == 5, f"alone={on_alone} score={zone.states.get('score')}")
+flip(p, 100, False)
+held = zone.onState
+flip(p, 200, False)
+flip(p, 200, True)
+check("and stays on down to the unoccupied score, but not back on below the occupied one",
+      held and not zone.onState and zone.states.get("score") == 2, f"held={held} onState={zone.onState}")
+
+p, zone = fresh({"sensorDevices": "100,200", "sensorWeights": "100:2:60", "onScore": "2", "offScore": "1"},
+                zone_type="scoreZone")
+p.clock = FakeClock(1000.0)
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 100, True)
+flip(p, 100, False)
+check("a decaying member keeps a zone on after it turns off, with the crossing scheduled",
+      zone.onState and abs(p.zones[1].scoreTimer - 1060.0) < 0.01, f"scoreTimer={p.zones[1].scoreTimer}")
+p.clock.now = 1030.0
+p.run_timers()
+flip(p, 200, True)  # weight 1 and no half-life: counts only while on, so the crossing stays put
+flip(p, 200, False)
+p.clock.now = 1060.0 + 0.01
+p.run_timers()
+check("the zone goes off when the decayed score crosses, without polling",
+      not zone.onState and p.counters["timersFired.score"] == 1 and p.counters["ticks"] == 2,
+      f"onState={zone.onState} counters={dict(p.counters)}")
+
+score = mod.WeightedScore({1: (1.0, 30.0), 2: (1.0, 90.0)})
+for member in (1, 2):
+    score.set_member(member, True, 0.0)
+    score.set_member(member, False, 0.0)
+crossing = score.falls_below(1.0, 0.0)
+exact = min(t / 100.0 for t in range(1, 20000) if 0.5 ** (t / 3000.0) + 0.5 ** (t / 9000.0) < 1.0)
+check("members with different half-lives decay as separate sums and cross where they should",
+      len(score.decaying) == 2 and abs(crossing - exact) < 0.01 and score.value(crossing) < 1.0,
+      f"crossing={crossing} exact={exact}")
+
+values = {"sensorDevices": "100", "sensorWeights": "100:3:0", "sensorDeviceMenu": "200", "sensorWeight": "2",
+          "sensorHalfLife": "45"}
+values = p.addDevice(values, "scoreZone", 1)
+listed = p.sensorDeviceList(valuesDict=values, typeId="scoreZone")
+check("the dialog keeps each sensor's weight and half-life", values["sensorWeights"] == "100:3:0,200:2:45"
+      and listed[1][1] == "Sensor200 (weight 2, half-life 45s)", f"{values['sensorWeights']} {listed}")
+
+
+# --- activity rate ------------------------------------------------------------------------------------------------
+
+p, zone = fresh({"sensorDevices": "100", "activityCount": "2", "activityWindow": "60", "statsRefresh": "30"},
+                zone_type="activityZone")
+p.clock = FakeClock(1000.0)
+p.startup()
+p.deviceStartComm(zone)
+p.run_timers()
+check("an activity zone with no activations publishes nothing", zone.batch_writes == [] and not p.counting,
+      f"{zone.batch_writes} {p.counting}")
+for when in (1000.0, 1010.0):
+    p.clock.now = when
+    flip(p, 100, True)
+    flip(p, 100, False)
+p.run_timers()
+check("the first activation publishes the rate figures on the next tick, in one batched write",
+      zone.batch_writes == [["activationsPerMinute", "activityLevel", "secondsSinceActivation"]]
+      and zone.states["secondsSinceActivation"] == 0 and p.zones[1].statsTimer == 1040.0,
+      f"{zone.batch_writes} {zone.states} statsTimer={p.zones[1].statsTimer}")
+rate = zone.states["activationsPerMinute"]
+p.clock.now = 1040.0
+p.run_timers()
+check("later publishes decay the rate and count up from the last activation",
+      zone.states["secondsSinceActivation"] == 30 and zone.states["activationsPerMinute"] < rate
+      and len(zone.batch_writes) == 2, f"{zone.states} {zone.batch_writes}")
+
+figures = mod.ActivityRate()
+for when in range(0, 600, 6):  # one activation every 6s, for ten minutes
+    figures.activation(float(when), 60.0)
+settled = figures.figures(600.0, 60.0, 10)
+check("a steady stream settles near its real rate", 9.0 < settled["activationsPerMinute"] < 11.0
+      and 0.9 < settled["activityLevel"] < 1.1, str(settled))
+
+p, zone = fresh({"sensorDevices": "100", "activityCount": "2", "activityWindow": "60", "statsRefresh": "0"},
+                zone_type="activityZone")
+p.startup()
+p.deviceStartComm(zone)
+flip(p, 100, True)
+p.run_timers()
+check("a publish cadence of 0 keeps the rate figures off the server",
+      zone.batch_writes == [] and p.zones[1].statsTimer is None, str(zone.batch_writes))
+
+
 passed = sum(1 for _, ok, _ in results if ok)
 print()
 for name, ok, detail in results: